@@ -2,8 +2,17 @@ import os
 import json
 import base64
 import traceback
-from models import db, User, TaskList, Task
-from flask import Flask, jsonify, request, session
+from functools import wraps
+from cache import ResponseCache
+from wire import negotiate_format, payload_response, compress_response
+from ratelimit import RateLimiter, SingleFlight
+from writebehind import WriteBehindBuffer, COALESCED_FIELDS
+from routing import SHARDED_TABLES, DatabaseRouter, use_primary, remember_write, replica_reads_allowed, copy_sqlite_database
+from avatars import (InvalidImage, THUMBNAIL_SIZES, THUMBNAIL_FORMATS, store_avatar, original_path,
+                     render_thumbnail, remove_avatar, stored_digests)
+from models import (db, User, TaskList, Task, TaskArchive, ARCHIVE_COLUMNS, upgrade_schema, shard_metadata,
+                    priority_rank_expression, priority_rank_for)
+from flask import Flask, Response, jsonify, request, session, send_file
 from flask_cors import CORS
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
@@ -11,19 +20,12 @@ from firebase_admin import credentials, initialize_app, auth
 import firebase_admin
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
-from sqlalchemy import func, and_
-from werkzeug.utils import secure_filename
+from sqlalchemy import func, and_, or_, insert, select, delete, literal, exists, false, case, bindparam
+from sqlalchemy.orm import aliased
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Define allowed extensions for file uploads
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
 def initialize_firebase_app():
     try:
         # Check if Firebase credentials are in environment variable
@@ -66,8 +68,15 @@ def initialize_firebase_app():
 # Create Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///app.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Threaded/ASGI deployments need at least one connection per request thread
+if os.environ.get('DB_POOL_SIZE'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': int(os.environ['DB_POOL_SIZE'])}
+# Optional read replicas and user-id shards (DATABASE_REPLICAS / DATABASE_SHARDS), see routing.py
+db_router = DatabaseRouter.from_env(os.environ)
+app.config['SQLALCHEMY_BINDS'] = db_router.binds
+app.extensions['db_router'] = db_router
 
 # Setup upload folder
 UPLOAD_FOLDER = 'static/uploads/avatars'
@@ -75,6 +84,34 @@ UPLOAD_FOLDER = 'static/uploads/avatars'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # 5MB max file size
+AVATAR_URL_PREFIX = '/api/avatars/'
+LEGACY_AVATAR_URL_PREFIX = '/static/uploads/avatars/'
+
+# Completed tasks older than this are moved to the task_archive table
+app.config['ARCHIVE_COMPLETED_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_COMPLETED_AFTER_DAYS', 60))
+# How often (seconds) a user's lists are swept for old completed tasks while they use the app
+app.config['ARCHIVE_SWEEP_INTERVAL'] = int(os.environ.get('ARCHIVE_SWEEP_INTERVAL', 6 * 60 * 60))
+
+# Response cache for list/task payloads: 'local' (in-process LRU only), 'sqlite' or 'redis'
+app.config['RESPONSE_CACHE_BACKEND'] = os.environ.get('RESPONSE_CACHE_BACKEND', 'local')
+app.config['RESPONSE_CACHE_URL'] = os.environ.get('RESPONSE_CACHE_URL', os.path.join(app.instance_path, 'response_cache.db'))
+app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+app.config['RESPONSE_CACHE_TTL'] = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+
+# Response compression (gzip, or brotli when installed) and streaming of large columnar payloads
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+app.config['STREAM_MIN_ROWS'] = int(os.environ.get('STREAM_MIN_ROWS', 2000))
+
+# Per-user token buckets for hot read routes: 'memory' (per process) or 'sqlite' (shared)
+app.config['RATE_LIMIT_BACKEND'] = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+app.config['RATE_LIMIT_URL'] = os.environ.get('RATE_LIMIT_URL', os.path.join(app.instance_path, 'rate_limits.db'))
+app.config['RATE_LIMITS'] = json.loads(os.environ.get('RATE_LIMITS', '{"task-lists": "120/minute", "stats": "60/minute"}'))
+
+# Optional write-behind for completed/title/priority/due_date task updates; see writebehind.py for the guarantees
+app.config['WRITE_BEHIND'] = os.environ.get('WRITE_BEHIND', '').lower() in ('1', 'true')
+app.config['WRITE_BEHIND_INTERVAL'] = float(os.environ.get('WRITE_BEHIND_INTERVAL', 1.0))
+app.config['WRITE_BEHIND_MAX_PENDING'] = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 1000))
 
 # Initialize Firebase BEFORE creating other app extensions
 initialize_firebase_app()
@@ -84,6 +121,17 @@ CORS(app, supports_credentials=True)
 bcrypt = Bcrypt(app)
 db.init_app(app)
 login_manager = LoginManager(app)
+response_cache = ResponseCache.from_config(app.config)
+rate_limiter = RateLimiter.from_config(app.config)
+single_flight = SingleFlight()
+
+@app.after_request
+def compress(response):
+    return compress_response(response, app.config)
+
+@app.after_request
+def stick_to_primary_after_write(response):
+    return remember_write(db_router, response)
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -92,6 +140,394 @@ def load_user(user_id):
 # Create database tables
 with app.app_context():
     db.create_all()
+    for shard in db_router.shards():
+        engine = db.engines[db_router.shard_bind_key(shard)]
+        if shard:
+            # Extra shards only hold the per-user tables; users stay on shard 0
+            shard_metadata(SHARDED_TABLES).create_all(engine)
+        upgrade_schema(engine)
+        if db_router.shard_count > 1:
+            # Placement is user_id % shard count and nothing moves existing rows, so refuse to
+            # start rather than hide lists that were created under a different shard count
+            with engine.connect() as conn:
+                misplaced = conn.scalar(select(func.count()).select_from(TaskList).where(
+                    TaskList.user_id % db_router.shard_count != shard))
+            if misplaced:
+                raise RuntimeError(f"Shard {shard} holds {misplaced} task lists of users that belong on "
+                                   f"another shard; DATABASE_SHARDS can only be set on fresh databases")
+        if engine.dialect.name == 'sqlite':
+            # WAL lets readers run alongside a writer when several threads or processes serve requests
+            with engine.connect() as conn:
+                conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+
+def cached_list_response(kind):
+    """Serve a list-scoped GET route from the response cache.
+    
+    Entries are keyed by user, list, list version and query string; write routes
+    call response_cache.invalidate() for every list they change. Only payloads read
+    from a primary are stored: a lagging replica could return data older than the
+    list version in the key.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(list_id, **kwargs):
+            key = list_cache_key(kind, list_id)
+            payload = response_cache.get(key)
+            if payload is not None:
+                return payload_response(payload, app.config)
+            
+            response = app.make_response(view(list_id, **kwargs))
+            if response.status_code == 200:
+                payload = response.get_json()
+                if not replica_reads_allowed(db_router) or db.session.info.get('wrote'):
+                    response_cache.set(key, payload)
+                if negotiate_format() != 'application/json':
+                    response = payload_response(payload, app.config)
+                response.vary.add('Accept')
+            return response
+        return wrapper
+    return decorator
+
+def list_cache_key(kind, list_id):
+    # The format is negotiated per request, so it isn't part of the key
+    args = sorted((k, v) for k, v in request.args.items(multi=True) if k != 'format')
+    return response_cache.key(kind, current_user.id, list_id, args)
+
+def rate_limit_response(name):
+    """The 429 response if this request is over the RATE_LIMITS[name] bucket, else None."""
+    allowed, retry_after = rate_limiter.hit(name, f"{request.endpoint}:{current_user.id}")
+    if not allowed:
+        return jsonify({"error": "Too many requests"}), 429, {"Retry-After": str(retry_after)}
+    return None
+
+def rate_limited(name):
+    """Limit a route per user with the token bucket configured under RATE_LIMITS[name]."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            return rate_limit_response(name) or view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def coalesced(view):
+    """Compute identical concurrent GETs from the same user once and share the response."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.endpoint, current_user.id, request.full_path, request.headers.get('Accept'))
+        
+        def run():
+            response = app.make_response(view(*args, **kwargs))
+            return response.get_data(), response.status_code, list(response.headers)
+        
+        body, status, headers = single_flight.do(key, run)
+        return Response(body, status=status, headers=headers)
+    return wrapper
+
+# Write-behind helpers
+def apply_task_updates(shard, entries):
+    """Write one shard's merged write-behind updates in a single transaction."""
+    # A buffered update loses to any change committed after it was acknowledged
+    statement = Task.__table__.update().where(
+        Task.id == bindparam('task_id'),
+        or_(Task.updated_at.is_(None), Task.updated_at <= bindparam('acked_at'))
+    )
+    
+    # executemany needs the same columns in every row, so batch rows by field set
+    batches = {}
+    for entry in entries:
+        row = dict(entry['fields'], task_id=entry['task_id'], acked_at=entry['acked_at'], updated_at=entry['acked_at'])
+        if 'priority' in row:
+            row['priority_rank'] = priority_rank_for(row['priority'])
+        batches.setdefault(tuple(sorted(row)), []).append(row)
+    
+    # Own app context (and session): this runs on the flusher thread, at exit, or mid-request
+    with app.app_context():
+        db.session.info['shard'] = shard
+        for rows in batches.values():
+            db.session.execute(statement, rows)
+        db.session.commit()
+    response_cache.invalidate(*[entry['task_list_id'] for entry in entries])
+
+write_behind = WriteBehindBuffer.from_config(app.config, apply_task_updates)
+
+def is_coalesced_update():
+    data = request.get_json(silent=True)
+    return (request.endpoint == 'update_task' and request.method == 'PUT'
+            and isinstance(data, dict) and bool(data) and set(data) <= COALESCED_FIELDS)
+
+@app.before_request
+def flush_pending_task_updates():
+    # Read-your-writes: a user's buffered updates are committed before any other request of theirs
+    if write_behind is None or is_coalesced_update():
+        return
+    if current_user.is_authenticated and write_behind.has_pending(current_user.id):
+        write_behind.flush(current_user.id)
+
+def parse_due_date(value):
+    """Parse an ISO 8601 or YYYY-MM-DD due date; raises ValueError."""
+    try:
+        # Try parsing as ISO format
+        return datetime.fromisoformat(value)
+    except ValueError:
+        # Try parsing as YYYY-MM-DD format
+        return datetime.strptime(value, '%Y-%m-%d')
+
+def check_coalesced_fields(data):
+    """Validate a completed/title/priority/due_date update; return (fields, None) or (None, error response)."""
+    fields = dict(data)
+    if 'title' in fields and not (isinstance(fields['title'], str) and len(fields['title']) <= 255):
+        return None, (jsonify({"error": "Title must be a string of at most 255 characters"}), 400)
+    if 'completed' in fields and not isinstance(fields['completed'], bool):
+        return None, (jsonify({"error": "Completed must be true or false"}), 400)
+    if 'priority' in fields and not (fields['priority'] is None or
+                                     isinstance(fields['priority'], str) and len(fields['priority']) <= 20):
+        return None, (jsonify({"error": "Priority must be a string of at most 20 characters"}), 400)
+    if 'due_date' in fields:
+        if not fields['due_date']:
+            fields['due_date'] = None
+        elif not isinstance(fields['due_date'], str):
+            return None, (jsonify({"error": "Invalid date format"}), 400)
+        else:
+            try:
+                fields['due_date'] = parse_due_date(fields['due_date'])
+            except ValueError:
+                return None, (jsonify({"error": "Invalid date format"}), 400)
+    return fields, None
+
+def buffered_update_response(task_id, task_list_id, merged):
+    # 202: accepted, committed within WRITE_BEHIND_INTERVAL or before this user's next request
+    response = {"id": task_id, "task_list_id": task_list_id, "pending": True}
+    for field, value in merged.items():
+        response[field] = value.isoformat() if isinstance(value, datetime) else value
+    return jsonify(response), 202
+
+def buffer_task_update(task_id, data):
+    """Acknowledge a completed/title/priority/due_date update and leave the write to write_behind."""
+    # Values are checked here, not at flush time: once acknowledged, an update must be writable
+    fields, error = check_coalesced_fields(data)
+    if error:
+        return error
+    
+    # The ownership check is skipped while this user already has an update queued for the task
+    shard = db_router.shard_for_user(current_user.id)
+    pending = write_behind.get(shard, task_id, current_user.id)
+    if pending:
+        task_list_id = pending['task_list_id']
+    else:
+        task_list_id = db.session.scalar(select(Task.task_list_id).join(TaskList).where(
+            Task.id == task_id,
+            TaskList.user_id == current_user.id
+        ))
+        if task_list_id is None:
+            return jsonify({"error": "Task not found"}), 404
+    
+    merged = write_behind.add(task_id, current_user.id, shard, task_list_id, fields)
+    return buffered_update_response(task_id, task_list_id, merged)
+
+# Archive helpers
+def wants_archived():
+    return request.args.get('include_archived') in ('1', 'true')
+
+def move_tasks_to_archive(condition, reason):
+    """Move the tasks matching `condition` into task_archive with one INSERT ... SELECT."""
+    columns = [Task.__table__.c[task_column] for task_column, _ in ARCHIVE_COLUMNS]
+    db.session.execute(insert(TaskArchive).from_select(
+        [archive_column for _, archive_column in ARCHIVE_COLUMNS] + ['archived_at', 'reason'],
+        select(*columns, literal(datetime.utcnow()), literal(reason)).where(condition)
+    ))
+    return db.session.execute(delete(Task).where(condition)).rowcount
+
+def archive_completed_tasks(days=None, task_list_ids=None, batch_size=500):
+    """Archive tasks completed more than `days` ago, leaves first, so a parent
+    only leaves the hot table once all of its subtasks have."""
+    if days is None:
+        days = app.config['ARCHIVE_COMPLETED_AFTER_DAYS']
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    child = aliased(Task)
+    
+    eligible = select(Task.id, Task.task_list_id).where(
+        Task.completed == True,
+        Task.updated_at < cutoff,
+        ~exists().where(child.parent_id == Task.id)
+    )
+    if task_list_ids is not None:
+        eligible = eligible.where(Task.task_list_id.in_(task_list_ids))
+    
+    archived = 0
+    changed_list_ids = set()
+    while True:
+        rows = db.session.execute(eligible.limit(batch_size)).all()
+        if not rows:
+            break
+        changed_list_ids.update(row.task_list_id for row in rows)
+        archived += move_tasks_to_archive(Task.id.in_([row.id for row in rows]), 'completed')
+    
+    db.session.commit()
+    response_cache.invalidate(*changed_list_ids)
+    return archived
+
+# user_id -> time of the last archive sweep in this process
+last_archive_sweep = {}
+
+def archive_sweep_due(user_id):
+    last_sweep = last_archive_sweep.get(user_id)
+    return not last_sweep or (datetime.utcnow() - last_sweep).total_seconds() >= app.config['ARCHIVE_SWEEP_INTERVAL']
+
+def maybe_archive_completed_tasks(user_id):
+    if not archive_sweep_due(user_id):
+        return
+    last_archive_sweep[user_id] = datetime.utcnow()
+    
+    # The sweep moves what it reads, so it must not read from a lagging replica
+    use_primary()
+    user_list_ids = select(TaskList.id).where(TaskList.user_id == user_id)
+    archive_completed_tasks(task_list_ids=user_list_ids)
+
+def collect_list_ids(task_list):
+    """Return the ids of a list and every list nested below it."""
+    list_ids = [task_list.id]
+    frontier = [task_list.id]
+    while frontier:
+        frontier = db.session.scalars(select(TaskList.id).where(TaskList.parent_id.in_(frontier))).all()
+        list_ids.extend(frontier)
+    return list_ids
+
+def sync_task_id_sequence():
+    """Move the Postgres id sequence past ids that were inserted explicitly (never backwards)."""
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text(
+            "SELECT setval(pg_get_serial_sequence('task', 'id'), GREATEST("
+            "pg_sequence_last_value(pg_get_serial_sequence('task', 'id')::regclass), (SELECT MAX(id) FROM task)))"
+        ), bind_arguments={'mapper': Task})
+
+def next_free_task_id():
+    """First id above every live task, archived task and id the database has handed out.
+    
+    Ids of deleted and archived tasks are never reused, so this is where an explicitly
+    numbered range of new tasks has to start. Call it after lock_task_ids().
+    """
+    used = [
+        db.session.scalar(select(func.max(Task.id))),
+        db.session.scalar(select(func.max(TaskArchive.task_id)))
+    ]
+    if db.engine.dialect.name == 'postgresql':
+        used.append(db.session.scalar(db.text(
+            "SELECT pg_sequence_last_value(pg_get_serial_sequence('task', 'id')::regclass)"
+        ), bind_arguments={'mapper': Task}))
+    elif db.engine.dialect.name == 'sqlite':
+        # sqlite_sequence only exists once a table with AUTOINCREMENT has been created
+        has_sequence = db.session.scalar(db.text(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_sequence'"
+        ), bind_arguments={'mapper': Task})
+        if has_sequence:
+            used.append(db.session.scalar(db.text("SELECT seq FROM sqlite_sequence WHERE name = 'task'"),
+                                          bind_arguments={'mapper': Task}))
+    return max((value for value in used if value is not None), default=0) + 1
+
+def lock_task_ids():
+    """Block other task inserts until this transaction ends, so a range of ids can be reserved."""
+    if db.engine.dialect.name == 'postgresql':
+        # Conflicts with itself and with plain INSERTs (nextval included), not with reads
+        db.session.execute(db.text('LOCK TABLE task IN SHARE ROW EXCLUSIVE MODE'), bind_arguments={'mapper': Task})
+    else:
+        # SQLite: any write statement, even one matching no rows, takes the database write lock
+        db.session.execute(Task.__table__.update().where(Task.id.is_(None)).values(id=Task.id))
+
+def restore_archived_list_tasks(list_ids):
+    """Move tasks archived together with their list back into the task table."""
+    archived = and_(TaskArchive.task_list_id.in_(list_ids), TaskArchive.reason == 'list')
+    archived_ids = select(TaskArchive.task_id).where(archived)
+    
+    # Databases created without AUTOINCREMENT may have handed an archived task's id to a new
+    # task in the meantime; if so shift the whole restored set (and the parent links within it)
+    # past every id in use
+    offset = 0
+    lock_task_ids()
+    if db.session.scalar(select(func.count()).select_from(Task).where(Task.id.in_(archived_ids))):
+        offset = next_free_task_id() - db.session.scalar(select(func.min(TaskArchive.task_id)).where(archived))
+    
+    columns = []
+    for _, archive_column in ARCHIVE_COLUMNS:
+        column = TaskArchive.__table__.c[archive_column]
+        if offset and archive_column in ('task_id', 'parent_id'):
+            column = column + offset
+        columns.append(column)
+    
+    # The archive has no priority_rank; derive it from the restored priority
+    columns.append(priority_rank_expression(TaskArchive.priority))
+    
+    db.session.execute(insert(Task).from_select(
+        [task_column for task_column, _ in ARCHIVE_COLUMNS] + ['priority_rank'], select(*columns).where(archived)))
+    sync_task_id_sequence()
+    return db.session.execute(delete(TaskArchive).where(archived)).rowcount
+
+# Duplication helpers
+def copy_tasks(source_ids, list_id_map, keep_outside_parents=False, reset_completed=False):
+    """Copy the tasks in `source_ids` with a single INSERT ... SELECT.
+    
+    New ids are the old ids shifted past every id in use (see next_free_task_id), so the parent links inside
+    the copied set can be remapped in SQL without a round trip per task. The id range is
+    reserved by locking task inserts until the caller commits. Parents outside
+    the set are dropped unless `keep_outside_parents` is set, e.g. to copy a subtree in place.
+    Returns the id offset and the number of copied tasks.
+    """
+    # With inserts locked out, nothing can take ids past next_free_task_id() before we do
+    lock_task_ids()
+    min_id, count = db.session.execute(
+        select(func.min(Task.id), func.count()).where(Task.id.in_(source_ids))
+    ).one()
+    if not count:
+        return 0, 0
+    
+    offset = next_free_task_id() - min_id
+    now = datetime.utcnow()
+    
+    parent_id = case(
+        (Task.parent_id.in_(source_ids), Task.parent_id + offset),
+        else_=Task.parent_id if keep_outside_parents else None
+    )
+    
+    db.session.execute(insert(Task).from_select(
+        ['id', 'title', 'completed', 'description', 'parent_id', 'level', 'priority',
+         'priority_rank', 'due_date', 'tags', 'task_list_id', 'created_at', 'updated_at'],
+        select(
+            Task.id + offset,
+            Task.title,
+            literal(False) if reset_completed else Task.completed,
+            Task.description,
+            parent_id,
+            Task.level,
+            Task.priority,
+            Task.priority_rank,
+            Task.due_date,
+            Task.tags,
+            case(list_id_map, value=Task.task_list_id),
+            literal(now),
+            literal(now)
+        ).where(Task.id.in_(source_ids)).order_by(Task.id)
+    ))
+    
+    sync_task_id_sequence()
+    return offset, count
+
+@app.cli.command('archive-tasks')
+def archive_tasks_command():
+    """Move old completed tasks out of the hot task table."""
+    archived = 0
+    for shard in db_router.shards():
+        db.session.info['shard'] = shard
+        archived += archive_completed_tasks()
+        db.session.remove()
+    print(f"Archived {archived} completed tasks")
+
+@app.cli.command('sync-replicas')
+def sync_replicas_command():
+    """Copy each SQLite primary over its replicas; a stand-in for replication in local setups."""
+    for shard, replica_keys in db_router.replica_keys.items():
+        primary = db.engines[db_router.shard_bind_key(shard)]
+        for key in replica_keys:
+            copy_sqlite_database(str(primary.url), str(db.engines[key].url))
+            print(f"Copied shard {shard} to {key}")
 
 # Authentication routes
 @app.route('/api/register', methods=['POST'])
@@ -152,21 +588,33 @@ def get_user():
 # Task List routes
 @app.route('/api/task-lists', methods=['GET'])
 @login_required
+@rate_limited('task-lists')
+@coalesced
 def get_task_lists():
-    task_lists = TaskList.query.filter_by(user_id=current_user.id, parent_id=None).all()
-    result = []
+    maybe_archive_completed_tasks(current_user.id)
     
-    for task_list in task_lists:
-        result.append({
-            "id": task_list.id,
-            "title": task_list.title,
-            "is_folder": task_list.is_folder,
-            "children": [{"id": child.id, "title": child.title, "is_folder": child.is_folder} 
-                        for child in task_list.children] if task_list.is_folder else []
-        })
+    include_archived = wants_archived()
+    query = TaskList.query.filter_by(user_id=current_user.id, parent_id=None)
+    if not include_archived:
+        query = query.filter(TaskList.is_archived == false())
+    task_lists = query.all()
+    result = [serialize_top_level_list(task_list, task_list.children, include_archived) for task_list in task_lists]
     
     return jsonify(result), 200
 
+def serialize_top_level_list(task_list, children, include_archived):
+    item = {
+        "id": task_list.id,
+        "title": task_list.title,
+        "is_folder": task_list.is_folder,
+        "children": [{"id": child.id, "title": child.title, "is_folder": child.is_folder} 
+                    for child in children
+                    if include_archived or not child.is_archived] if task_list.is_folder else []
+    }
+    if include_archived:
+        item["is_archived"] = bool(task_list.is_archived)
+    return item
+
 @app.route('/api/task-lists', methods=['POST'])
 @login_required
 def create_task_list():
@@ -181,6 +629,7 @@ def create_task_list():
     
     db.session.add(new_task_list)
     db.session.commit()
+    response_cache.invalidate(new_task_list.parent_id)
     
     return jsonify({
         "id": new_task_list.id,
@@ -191,6 +640,7 @@ def create_task_list():
 
 @app.route('/api/task-lists/<int:list_id>', methods=['GET'])
 @login_required
+@cached_list_response('list')
 def get_task_list(list_id):
     task_list = TaskList.query.filter_by(id=list_id, user_id=current_user.id).first()
     
@@ -202,13 +652,16 @@ def get_task_list(list_id):
         "title": task_list.title,
         "is_folder": task_list.is_folder,
         "description": task_list.description if hasattr(task_list, 'description') else None,
-        "created_at": task_list.created_at.isoformat() if hasattr(task_list, 'created_at') else None
+        "created_at": task_list.created_at.isoformat() if hasattr(task_list, 'created_at') else None,
+        "is_archived": bool(task_list.is_archived)
     }
     
     if task_list.is_folder:
+        include_archived = wants_archived()
         result["children"] = [
             {"id": child.id, "title": child.title, "is_folder": child.is_folder} 
             for child in task_list.children
+            if include_archived or not child.is_archived
         ]
     
     return jsonify(result), 200
@@ -222,6 +675,7 @@ def update_task_list(list_id):
         return jsonify({"error": "Task list not found"}), 404
     
     data = request.json
+    previous_parent_id = task_list.parent_id
     
     if 'title' in data:
         task_list.title = data['title']
@@ -236,6 +690,7 @@ def update_task_list(list_id):
         task_list.description = data['description']
     
     db.session.commit()
+    response_cache.invalidate(task_list.id, previous_parent_id, task_list.parent_id)
     
     return jsonify({
         "id": task_list.id,
@@ -253,40 +708,197 @@ def delete_task_list(list_id):
     if not task_list:
         return jsonify({"error": "Task list not found"}), 404
     
+    parent_id = task_list.parent_id
+    # Archived tasks aren't in the tasks relationship, so remove them explicitly.
+    # Nested lists survive the delete (they become top-level), and so do their archives
+    db.session.execute(delete(TaskArchive).where(TaskArchive.task_list_id == list_id))
     db.session.delete(task_list)
     db.session.commit()
+    response_cache.invalidate(list_id, parent_id)
     
     return jsonify({"message": "Task list deleted successfully"}), 200
 
+@app.route('/api/task-lists/<int:list_id>/archive', methods=['POST'])
+@login_required
+def archive_task_list(list_id):
+    task_list = TaskList.query.filter_by(id=list_id, user_id=current_user.id).first()
+    
+    if not task_list:
+        return jsonify({"error": "Task list not found"}), 404
+    
+    # Archive the list together with any nested lists and move all their tasks out of the hot table
+    list_ids = collect_list_ids(task_list)
+    TaskList.query.filter(TaskList.id.in_(list_ids)).update(
+        {TaskList.is_archived: True}, synchronize_session=False)
+    archived = move_tasks_to_archive(Task.task_list_id.in_(list_ids), 'list')
+    db.session.commit()
+    response_cache.invalidate(task_list.parent_id, *list_ids)
+    
+    return jsonify({
+        "id": task_list.id,
+        "is_archived": True,
+        "archived_lists": len(list_ids),
+        "archived_tasks": archived
+    }), 200
+
+@app.route('/api/task-lists/<int:list_id>/unarchive', methods=['POST'])
+@login_required
+def unarchive_task_list(list_id):
+    task_list = TaskList.query.filter_by(id=list_id, user_id=current_user.id).first()
+    
+    if not task_list:
+        return jsonify({"error": "Task list not found"}), 404
+    
+    list_ids = collect_list_ids(task_list)
+    TaskList.query.filter(TaskList.id.in_(list_ids)).update(
+        {TaskList.is_archived: False}, synchronize_session=False)
+    restored = restore_archived_list_tasks(list_ids)
+    db.session.commit()
+    response_cache.invalidate(task_list.parent_id, *list_ids)
+    
+    return jsonify({
+        "id": task_list.id,
+        "is_archived": False,
+        "restored_tasks": restored
+    }), 200
+
+@app.route('/api/task-lists/<int:list_id>/duplicate', methods=['POST'])
+@login_required
+def duplicate_task_list(list_id):
+    task_list = TaskList.query.filter_by(id=list_id, user_id=current_user.id).first()
+    
+    if not task_list:
+        return jsonify({"error": "Task list not found"}), 404
+    
+    data = request.get_json(silent=True) or {}
+    
+    # Copy the list and any nested lists first; there are only a handful of these
+    list_ids = collect_list_ids(task_list)
+    source_lists = {source.id: source for source in TaskList.query.filter(TaskList.id.in_(list_ids)).all()}
+    list_id_map = {}
+    
+    for source_id in list_ids:
+        source = source_lists[source_id]
+        new_list = TaskList(
+            title=data.get('title', f"{source.title} (copy)") if source_id == list_id else source.title,
+            is_folder=source.is_folder,
+            description=source.description,
+            user_id=current_user.id
+        )
+        if source_id == list_id:
+            new_list.parent_id = source.parent_id
+        else:
+            new_list.parent = list_id_map[source.parent_id]
+        db.session.add(new_list)
+        list_id_map[source_id] = new_list
+    
+    db.session.flush()
+    list_id_map = {source_id: new_list.id for source_id, new_list in list_id_map.items()}
+    
+    source_ids = select(Task.id).where(Task.task_list_id.in_(list_ids))
+    _, copied = copy_tasks(source_ids, list_id_map, reset_completed=data.get('reset_completed', False))
+    db.session.commit()
+    response_cache.invalidate(task_list.parent_id, *list_id_map.values())
+    
+    new_task_list = db.session.get(TaskList, list_id_map[list_id])
+    return jsonify({
+        "id": new_task_list.id,
+        "title": new_task_list.title,
+        "is_folder": new_task_list.is_folder,
+        "parent_id": new_task_list.parent_id,
+        "copied_lists": len(list_ids),
+        "copied_tasks": copied
+    }), 201
+
 # Task routes
+def serialize_task(task):
+    return {
+        "id": task.task_id if isinstance(task, TaskArchive) else task.id,
+        "title": task.title,
+        "completed": task.completed,
+        "parent_id": task.parent_id,
+        "level": task.level if hasattr(task, 'level') else 0,
+        "created_at": task.created_at.isoformat(),
+        "updated_at": task.updated_at.isoformat(),
+        "description": task.description if hasattr(task, 'description') else None,
+        "due_date": task.due_date.isoformat() if hasattr(task, 'due_date') and task.due_date else None,
+        "priority": task.priority if hasattr(task, 'priority') else None,
+        "tags": task.tags.split(',') if hasattr(task, 'tags') and task.tags else []
+    }
+
+def page_args(default_limit=100, max_limit=500):
+    cursor = request.args.get('cursor', type=int)
+    limit = max(1, min(request.args.get('limit', default_limit, type=int), max_limit))
+    return cursor, limit
+
+def task_page_query(condition, cursor, limit):
+    """Select one keyset page of tasks matching `condition`, ordered by id, with child counts.
+    
+    The counts are correlated subqueries in the same statement; like the page itself
+    they are answered from the (task_list_id, parent_id) index. One row past the page
+    is selected to tell whether there is a next page.
+    """
+    child = aliased(Task)
+    children = select(func.count()).select_from(child).where(
+        child.task_list_id == Task.task_list_id,
+        child.parent_id == Task.id
+    )
+    child_count = children.scalar_subquery()
+    completed_child_count = children.where(child.completed == True).scalar_subquery()
+    
+    query = select(Task, child_count, completed_child_count).where(condition)
+    if cursor is not None:
+        query = query.where(Task.id > cursor)
+    return query.order_by(Task.id).limit(limit + 1)
+
+def task_page(condition, cursor, limit):
+    return task_page_payload(db.session.execute(task_page_query(condition, cursor, limit)).all(), limit)
+
+def task_page_payload(rows, limit):
+    items = []
+    for task, task_child_count, task_completed_child_count in rows[:limit]:
+        task_data = serialize_task(task)
+        task_data["child_count"] = task_child_count
+        task_data["completed_child_count"] = task_completed_child_count
+        items.append(task_data)
+    
+    return {
+        "items": items,
+        "next_cursor": items[-1]["id"] if len(rows) > limit else None
+    }
+
 @app.route('/api/task-lists/<int:list_id>/tasks', methods=['GET'])
 @login_required
+@cached_list_response('tasks')
 def get_tasks(list_id):
     task_list = TaskList.query.filter_by(id=list_id, user_id=current_user.id).first()
     
     if not task_list:
         return jsonify({"error": "Task list not found"}), 404
     
+    # Windowed mode: one page of top-level tasks; children are fetched on expand
+    if request.args.get('window') in ('1', 'true'):
+        cursor, limit = page_args()
+        page = task_page(and_(Task.task_list_id == list_id, Task.parent_id.is_(None)), cursor, limit)
+        return jsonify(page), 200
+    
     tasks = Task.query.filter_by(task_list_id=list_id).all()
     
+    # Archived tasks are only returned when history is explicitly requested
+    include_archived = wants_archived()
+    if include_archived:
+        tasks += TaskArchive.query.filter_by(task_list_id=list_id).all()
+    
+    return jsonify(serialize_list_tasks(tasks, include_archived)), 200
+
+def serialize_list_tasks(tasks, include_archived):
     result = []
     for task in tasks:
-        task_data = {
-            "id": task.id,
-            "title": task.title,
-            "completed": task.completed,
-            "parent_id": task.parent_id,
-            "level": task.level if hasattr(task, 'level') else 0,
-            "created_at": task.created_at.isoformat(),
-            "updated_at": task.updated_at.isoformat(),
-            "description": task.description if hasattr(task, 'description') else None,
-            "due_date": task.due_date.isoformat() if hasattr(task, 'due_date') and task.due_date else None,
-            "priority": task.priority if hasattr(task, 'priority') else None,
-            "tags": task.tags.split(',') if hasattr(task, 'tags') and task.tags else []
-        }
+        task_data = serialize_task(task)
+        if include_archived:
+            task_data["archived"] = isinstance(task, TaskArchive)
         result.append(task_data)
-    
-    return jsonify(result), 200
+    return result
 
 @app.route('/api/task-lists/<int:list_id>/tasks', methods=['POST'])
 @login_required
@@ -332,6 +944,7 @@ def create_task(list_id):
     
     db.session.add(new_task)
     db.session.commit()
+    response_cache.invalidate(list_id)
     
     # Build response
     response = {
@@ -362,6 +975,9 @@ def create_task(list_id):
 @app.route('/api/tasks/<int:task_id>', methods=['PUT'])
 @login_required
 def update_task(task_id):
+    if write_behind is not None and is_coalesced_update():
+        return buffer_task_update(task_id, request.json)
+    
     task = Task.query.join(TaskList).filter(
         Task.id == task_id,
         TaskList.user_id == current_user.id
@@ -371,6 +987,7 @@ def update_task(task_id):
         return jsonify({"error": "Task not found"}), 404
     
     data = request.json
+    previous_list_id = task.task_list_id
     
     # Update basic fields
     if 'title' in data:
@@ -435,17 +1052,11 @@ def update_task(task_id):
         # Add proper datetime parsing with error handling
         if data['due_date']:
             try:
-                # Try parsing as ISO format
-                task.due_date = datetime.fromisoformat(data['due_date'])
+                task.due_date = parse_due_date(data['due_date'])
                 print(f"Successfully set due_date to: {task.due_date}")
             except ValueError:
-                try:
-                    # Try parsing as YYYY-MM-DD format
-                    task.due_date = datetime.strptime(data['due_date'], '%Y-%m-%d')
-                    print(f"Successfully set due_date to: {task.due_date} (using date-only format)")
-                except ValueError:
-                    print(f"Failed to parse due_date: {data['due_date']}")
-                    return jsonify({"error": "Invalid date format"}), 400
+                print(f"Failed to parse due_date: {data['due_date']}")
+                return jsonify({"error": "Invalid date format"}), 400
         else:
             task.due_date = None
             print("Set due_date to None")
@@ -457,8 +1068,11 @@ def update_task(task_id):
         task.tags = ','.join(data['tags']) if isinstance(data['tags'], list) else data['tags']
     
     db.session.commit()
+    response_cache.invalidate(previous_list_id, task.task_list_id)
     
-    # Build response
+    return jsonify(serialize_updated_task(task)), 200
+
+def serialize_updated_task(task):
     response = {
         "id": task.id,
         "title": task.title,
@@ -485,7 +1099,7 @@ def update_task(task_id):
     if hasattr(task, 'tags'):
         response["tags"] = task.tags.split(',') if task.tags else []
     
-    return jsonify(response), 200
+    return response
 
 @app.route('/api/tasks/<int:task_id>', methods=['DELETE'])
 @login_required
@@ -505,12 +1119,128 @@ def delete_task(task_id):
             delete_children(child.id)
             db.session.delete(child)
     
+    task_list_id = task.task_list_id
     delete_children(task.id)
     db.session.delete(task)
     db.session.commit()
+    response_cache.invalidate(task_list_id)
     
     return jsonify({"message": "Task and all subtasks deleted successfully"}), 200
 
+@app.route('/api/tasks/<int:task_id>/children', methods=['GET'])
+@login_required
+def get_task_children(task_id):
+    task = Task.query.join(TaskList).filter(
+        Task.id == task_id,
+        TaskList.user_id == current_user.id
+    ).first()
+    
+    if not task:
+        return jsonify({"error": "Task not found"}), 404
+    
+    cursor, limit = page_args()
+    page = task_page(and_(Task.task_list_id == task.task_list_id, Task.parent_id == task.id), cursor, limit)
+    return payload_response(page, app.config)
+
+# SQLite allows at most 500 terms in a compound SELECT
+NEXT_TASKS_LISTS_PER_QUERY = 200
+
+@app.route('/api/tasks/next', methods=['GET'])
+@login_required
+def get_next_tasks():
+    """The user's K open tasks to do next: highest priority first, then earliest due date.
+    
+    Each list contributes its own top K, read in order from the ix_task_next index,
+    and only those candidates are merged, so the cost doesn't grow with the number
+    of open tasks.
+    """
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    
+    list_titles = dict(db.session.execute(
+        select(TaskList.id, TaskList.title).where(
+            TaskList.user_id == current_user.id,
+            TaskList.is_archived == false(),
+            TaskList.is_folder == false()
+        )
+    ).all())
+    if not list_titles:
+        return jsonify([]), 200
+    
+    undated = Task.due_date.is_(None).label('undated')
+    list_ids = list(list_titles)
+    candidates = []
+    # Users with many lists are merged in batches, then the batch winners once more below
+    for start in range(0, len(list_ids), NEXT_TASKS_LISTS_PER_QUERY):
+        terms = []
+        for list_id in list_ids[start:start + NEXT_TASKS_LISTS_PER_QUERY]:
+            top = select(Task.id, Task.priority_rank, undated, Task.due_date).where(
+                Task.task_list_id == list_id,
+                Task.completed == False
+            ).order_by(Task.priority_rank, undated, Task.due_date, Task.id).limit(limit).subquery()
+            terms.append(select(*top.c))
+        
+        merged = terms[0].union_all(*terms[1:]).subquery()
+        candidates += db.session.execute(
+            select(merged.c.id, merged.c.priority_rank, merged.c.undated, merged.c.due_date)
+            .order_by(merged.c.priority_rank, merged.c.undated, merged.c.due_date, merged.c.id)
+            .limit(limit)
+        ).all()
+    
+    candidates.sort(key=lambda row: (row.priority_rank, row.undated, row.due_date or datetime.min, row.id))
+    task_ids = [row.id for row in candidates[:limit]]
+    
+    tasks = {task.id: task for task in Task.query.filter(Task.id.in_(task_ids)).all()}
+    
+    result = []
+    for task_id in task_ids:
+        task_data = serialize_task(tasks[task_id])
+        task_data["task_list_id"] = tasks[task_id].task_list_id
+        task_data["task_list_title"] = list_titles[tasks[task_id].task_list_id]
+        result.append(task_data)
+    
+    return jsonify(result), 200
+
+@app.route('/api/tasks/<int:task_id>/duplicate', methods=['POST'])
+@login_required
+def duplicate_task(task_id):
+    task = Task.query.join(TaskList).filter(
+        Task.id == task_id,
+        TaskList.user_id == current_user.id
+    ).first()
+    
+    if not task:
+        return jsonify({"error": "Task not found"}), 404
+    
+    data = request.get_json(silent=True) or {}
+    
+    # The task and all of its descendants, resolved in the database
+    subtree = select(Task.id).where(Task.id == task_id).cte('subtree', recursive=True)
+    subtree = subtree.union_all(select(Task.id).where(Task.parent_id == subtree.c.id))
+    
+    # The copy lands next to the original, under the same parent
+    offset, copied = copy_tasks(
+        select(subtree.c.id),
+        {task.task_list_id: task.task_list_id},
+        keep_outside_parents=True,
+        reset_completed=data.get('reset_completed', False)
+    )
+    
+    new_task = db.session.get(Task, task_id + offset)
+    if 'title' in data:
+        new_task.title = data['title']
+    db.session.commit()
+    response_cache.invalidate(task.task_list_id)
+    
+    return jsonify({
+        "id": new_task.id,
+        "title": new_task.title,
+        "completed": new_task.completed,
+        "parent_id": new_task.parent_id,
+        "task_list_id": new_task.task_list_id,
+        "level": new_task.level,
+        "copied_tasks": copied
+    }), 201
+
 @app.route('/api/tasks/<int:task_id>/delete-keep-children', methods=['POST'])
 @login_required
 def delete_task_keep_children(task_id):
@@ -542,6 +1272,7 @@ def delete_task_keep_children(task_id):
     # Delete the task
     db.session.delete(task)
     db.session.commit()
+    response_cache.invalidate(task_list_id)
     
     return jsonify({"message": "Task deleted and children preserved"}), 200
     
@@ -613,6 +1344,8 @@ def firebase_login():  # Changed method name to be unique
 # Stats routes
 @app.route('/api/stats/tasks/weekly', methods=['GET'])
 @login_required
+@rate_limited('stats')
+@coalesced
 def get_weekly_task_stats():
     # Get date 7 days ago from now
     start_date = datetime.utcnow() - timedelta(days=6)
@@ -661,6 +1394,8 @@ def get_weekly_task_stats():
 
 @app.route('/api/stats/tasks/monthly', methods=['GET'])
 @login_required
+@rate_limited('stats')
+@coalesced
 def get_monthly_task_stats():
     # Get date 30 days ago from now
     start_date = datetime.utcnow() - timedelta(days=29)
@@ -709,6 +1444,8 @@ def get_monthly_task_stats():
 
 @app.route('/api/stats/tasks/high-priority', methods=['GET'])
 @login_required
+@rate_limited('stats')
+@coalesced
 def get_high_priority_tasks():
     # Get all task lists for the current user
     user_task_lists = TaskList.query.filter_by(user_id=current_user.id).all()
@@ -762,6 +1499,11 @@ def get_high_priority_tasks():
     
     return jsonify(result), 200
 
+@app.route('/api/cache/stats', methods=['GET'])
+@login_required
+def get_cache_stats():
+    return jsonify(response_cache.stats()), 200
+
 # Profile routes
 @app.route('/api/profile', methods=['GET'])
 @login_required
@@ -783,6 +1525,9 @@ def get_profile():
         "created_at": current_user.created_at.isoformat() if current_user.created_at else None
     }
     
+    if current_user.avatar and current_user.avatar.startswith(AVATAR_URL_PREFIX):
+        user_profile["avatar_thumbnails"] = avatar_urls(current_user.avatar)
+    
     return jsonify(user_profile), 200
 
 @app.route('/api/profile', methods=['PUT'])
@@ -838,27 +1583,95 @@ def upload_avatar():
     if file.filename == '':
         return jsonify({"error": "No file selected"}), 400
     
-    if file and allowed_file(file.filename):
-        # Create unique filename using user ID and timestamp
-        filename = secure_filename(f"user_{current_user.id}_{int(datetime.utcnow().timestamp())}.{file.filename.rsplit('.', 1)[1].lower()}")
-        
-        # Save file
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Update user's avatar field if the column exists
-        if hasattr(current_user, 'avatar'):
-            current_user.avatar = f"/static/uploads/avatars/{filename}"
-            db.session.commit()
-        else:
-            return jsonify({"error": "Avatar field not available on User model"}), 500
-        
-        return jsonify({
-            "message": "Avatar uploaded successfully",
-            "avatar": current_user.avatar
-        }), 200
+    # Validate by decoding the image and store it under its content hash
+    try:
+        digest = store_avatar(app.config['UPLOAD_FOLDER'], file.read())
+    except InvalidImage as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Update user's avatar field if the column exists
+    if hasattr(current_user, 'avatar'):
+        previous_avatar = current_user.avatar
+        current_user.avatar = f"{AVATAR_URL_PREFIX}{digest}"
+        db.session.commit()
+        if previous_avatar != current_user.avatar:
+            collect_avatar(previous_avatar)
+    else:
+        return jsonify({"error": "Avatar field not available on User model"}), 500
     
-    return jsonify({"error": "File type not allowed"}), 400
+    return jsonify({
+        "message": "Avatar uploaded successfully",
+        "avatar": current_user.avatar,
+        "thumbnails": avatar_urls(current_user.avatar)
+    }), 200
+
+def collect_avatar(avatar_url):
+    """Delete an avatar's files once no user points at it any more."""
+    if not avatar_url or User.query.filter_by(avatar=avatar_url).first():
+        return
+    
+    if avatar_url.startswith(AVATAR_URL_PREFIX):
+        remove_avatar(app.config['UPLOAD_FOLDER'], avatar_url[len(AVATAR_URL_PREFIX):])
+    elif avatar_url.startswith(LEGACY_AVATAR_URL_PREFIX):
+        legacy_path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(avatar_url))
+        if os.path.isfile(legacy_path):
+            os.remove(legacy_path)
+
+def avatar_urls(avatar_url):
+    return {
+        f"{size}.{extension}": f"{avatar_url}/{size}.{extension}"
+        for size in THUMBNAIL_SIZES for extension in THUMBNAIL_FORMATS
+    }
+
+def send_avatar_file(path, etag):
+    # Avatar URLs are content addressed, so a response never goes stale
+    response = send_file(os.path.abspath(path), conditional=True, etag=etag)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+def valid_digest(digest):
+    return len(digest) == 64 and all(c in '0123456789abcdef' for c in digest)
+
+@app.route('/api/avatars/<digest>', methods=['GET'])
+def get_avatar(digest):
+    path = original_path(app.config['UPLOAD_FOLDER'], digest) if valid_digest(digest) else None
+    
+    if not path:
+        return jsonify({"error": "Avatar not found"}), 404
+    
+    return send_avatar_file(path, digest)
+
+@app.route('/api/avatars/<digest>/<int:size>.<extension>', methods=['GET'])
+def get_avatar_thumbnail(digest, size, extension):
+    if not valid_digest(digest) or size not in THUMBNAIL_SIZES or extension not in THUMBNAIL_FORMATS \
+            or not original_path(app.config['UPLOAD_FOLDER'], digest):
+        return jsonify({"error": "Avatar not found"}), 404
+    
+    # Normally rendered in the background after upload; render now if that hasn't finished
+    path = render_thumbnail(app.config['UPLOAD_FOLDER'], digest, size, extension)
+    return send_avatar_file(path, f"{digest}-{size}-{extension}")
+
+@app.cli.command('gc-avatars')
+def gc_avatars_command():
+    """Delete stored avatars that no user references."""
+    folder = app.config['UPLOAD_FOLDER']
+    referenced = {avatar for (avatar,) in db.session.query(User.avatar).filter(User.avatar.isnot(None))}
+    # Skip very recent files; their upload request may not have committed yet
+    cutoff = datetime.utcnow().timestamp() - 3600
+    removed = 0
+    
+    for digest in stored_digests(folder):
+        if AVATAR_URL_PREFIX + digest not in referenced and os.path.getmtime(os.path.join(folder, digest)) < cutoff:
+            remove_avatar(folder, digest)
+            removed += 1
+    
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if os.path.isfile(path) and LEGACY_AVATAR_URL_PREFIX + name not in referenced and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            removed += 1
+    
+    print(f"Removed {removed} unreferenced avatars")
 
 @app.route('/api/profile/password', methods=['PUT'])
 @login_required
@@ -0,0 +1,324 @@
+"""ASGI entry point for the API, with async views for the hot routes.
+
+The task list and task loads, task updates and Firebase login run as coroutines on
+the event loop, with their database I/O on SQLAlchemy's async engine (aiosqlite,
+asyncpg), so a request waiting on the database doesn't hold a thread. Every other
+route is served by the regular Flask app on a thread pool (a2wsgi). Both share
+the same URL map, session cookie, response cache, rate limits and after_request
+hooks, so the API is the same as under gunicorn.
+
+    RESPONSE_CACHE_BACKEND=sqlite uvicorn asgi:asgi_app --port 5001 --workers 2
+
+ASGI_THREADS sets the thread pool size per process (default 16); the sync engine's
+pool is sized to match unless DB_POOL_SIZE is set. The async views use a pool of
+ASYNC_DB_POOL_SIZE connections per database (default 64). asyncpg connections
+need no threads; aiosqlite runs each SQLite connection on a thread of its own, since
+SQLite has no non-blocking API. SQLite also takes one writer at a time, so keep
+the pool small there (e.g. 8), or queued writes time out on the database lock.
+"""
+import asyncio
+import io
+import os
+import traceback
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from firebase_admin import auth
+from flask import g, jsonify, request, session
+from flask_login import login_user
+from sqlalchemy import and_, false, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.exceptions import HTTPException
+
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 16))
+ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE', 64))
+os.environ.setdefault('DB_POOL_SIZE', str(ASGI_THREADS))
+
+# DB_POOL_SIZE must be set before app configures the sync engine
+from routing import replica_reads_allowed  # noqa: E402
+from wire import payload_response  # noqa: E402
+from app import (app, bcrypt, db, db_router, login_manager, response_cache, write_behind, archive_sweep_due,
+                 maybe_archive_completed_tasks, wants_archived, rate_limit_response, list_cache_key, page_args,
+                 task_page_query, task_page_payload, serialize_list_tasks, serialize_top_level_list,
+                 is_coalesced_update, check_coalesced_fields, buffered_update_response, serialize_updated_task)  # noqa: E402
+from models import User, TaskList, Task, TaskArchive  # noqa: E402
+
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+
+def async_sessionmakers():
+    """One async sessionmaker per bind (shards, replicas), on the URLs Flask-SQLAlchemy resolved."""
+    makers = {}
+    with app.app_context():
+        for key, engine in db.engines.items():
+            url = engine.url.set(drivername=ASYNC_DRIVERS[engine.url.get_backend_name()])
+            async_engine = create_async_engine(url, pool_size=ASYNC_DB_POOL_SIZE)
+            makers[key] = async_sessionmaker(async_engine, expire_on_commit=False)
+    return makers
+
+sessions = async_sessionmakers()
+
+
+def read_session(shard):
+    """Session for reads on `shard`: a replica when the sync routes would use one."""
+    return sessions[db_router.bind_key(shard, replica_reads_allowed(db_router))]()
+
+
+def write_session(shard):
+    return sessions[db_router.bind_key(shard, False)]()
+
+
+def user_shard():
+    return db_router.shard_for_user(g._login_user.id)
+
+
+async def load_current_user():
+    """Load the session cookie's user without blocking and hand it to Flask-Login."""
+    user = None
+    user_id = session.get('_user_id')
+    if user_id is not None:
+        async with read_session(0) as db_session:
+            user = await db_session.get(User, int(user_id))
+    # Flask-Login only calls the (sync) user_loader when g has no user yet
+    g._login_user = user or login_manager.anonymous_user()
+    return user
+
+
+# Async views; each mirrors the Flask view of the same endpoint in app.py
+
+async def get_task_lists():
+    user = g._login_user
+    limited = rate_limit_response('task-lists')
+    if limited:
+        return limited
+
+    # The sweep is a rare bulk move; it keeps the sync session and runs on a thread
+    if archive_sweep_due(user.id):
+        await asyncio.to_thread(maybe_archive_completed_tasks, user.id)
+
+    include_archived = wants_archived()
+    query = select(TaskList).where(TaskList.user_id == user.id, TaskList.parent_id.is_(None))
+    if not include_archived:
+        query = query.where(TaskList.is_archived == false())
+
+    async with read_session(user_shard()) as db_session:
+        task_lists = (await db_session.scalars(query.order_by(TaskList.id))).all()
+        # All folders' children in one query instead of a lazy load per folder
+        children = {}
+        folder_ids = [task_list.id for task_list in task_lists if task_list.is_folder]
+        if folder_ids:
+            child_query = select(TaskList).where(TaskList.parent_id.in_(folder_ids)).order_by(TaskList.id)
+            for child in await db_session.scalars(child_query):
+                children.setdefault(child.parent_id, []).append(child)
+
+    result = [serialize_top_level_list(task_list, children.get(task_list.id, []), include_archived)
+              for task_list in task_lists]
+    return jsonify(result), 200
+
+
+async def get_tasks(list_id):
+    user = g._login_user
+    key = list_cache_key('tasks', list_id)
+    payload = response_cache.get(key)
+    if payload is not None:
+        return payload_response(payload, app.config)
+
+    # Payloads from a lagging replica aren't cached, as in cached_list_response
+    from_replica = replica_reads_allowed(db_router)
+    async with read_session(user_shard()) as db_session:
+        owned = await db_session.scalar(select(TaskList.id).where(TaskList.id == list_id, TaskList.user_id == user.id))
+        if owned is None:
+            return jsonify({"error": "Task list not found"}), 404
+
+        if request.args.get('window') in ('1', 'true'):
+            cursor, limit = page_args()
+            rows = (await db_session.execute(task_page_query(
+                and_(Task.task_list_id == list_id, Task.parent_id.is_(None)), cursor, limit))).all()
+            payload = task_page_payload(rows, limit)
+        else:
+            tasks = list((await db_session.scalars(select(Task).where(Task.task_list_id == list_id))).all())
+            include_archived = wants_archived()
+            if include_archived:
+                tasks += (await db_session.scalars(select(TaskArchive).where(TaskArchive.task_list_id == list_id))).all()
+            payload = serialize_list_tasks(tasks, include_archived)
+
+    if not from_replica:
+        response_cache.set(key, payload)
+    return payload_response(payload, app.config)
+
+
+async def update_task(task_id):
+    # Only completed/title/priority/due_date updates; moves and re-parenting stay on the sync view
+    if not is_coalesced_update():
+        return None
+    fields, error = check_coalesced_fields(request.json)
+    if error:
+        return error
+
+    user = g._login_user
+    shard = user_shard()
+    if write_behind is not None:
+        pending = write_behind.get(shard, task_id, user.id)
+        if pending:
+            task_list_id = pending['task_list_id']
+        else:
+            async with write_session(shard) as db_session:
+                task_list_id = await db_session.scalar(select(Task.task_list_id).join(TaskList).where(
+                    Task.id == task_id, TaskList.user_id == user.id))
+            if task_list_id is None:
+                return jsonify({"error": "Task not found"}), 404
+        # add() flushes synchronously once the buffer is full
+        merged = await asyncio.to_thread(write_behind.add, task_id, user.id, shard, task_list_id, fields)
+        return buffered_update_response(task_id, task_list_id, merged)
+
+    async with write_session(shard) as db_session:
+        task = await db_session.scalar(select(Task).join(TaskList).where(Task.id == task_id, TaskList.user_id == user.id))
+        if task is None:
+            return jsonify({"error": "Task not found"}), 404
+        for field, value in fields.items():
+            setattr(task, field, value)
+        await db_session.commit()
+    response_cache.invalidate(task.task_list_id)
+
+    return jsonify(serialize_updated_task(task)), 200
+
+
+async def firebase_login():
+    data = request.json
+
+    id_token = data.get('idToken')
+    email = data.get('email')
+    name = data.get('name', '')
+
+    if not id_token or not email:
+        return jsonify({"error": "Missing authentication credentials"}), 400
+
+    try:
+        # firebase_admin has no asyncio API, so the token check (certificates, revocation) runs on a thread
+        decoded_token = await asyncio.to_thread(auth.verify_id_token, id_token,
+                                                check_revoked=True, clock_skew_seconds=60)
+
+        if decoded_token.get('email') != email:
+            print(f"Email mismatch: token email {decoded_token.get('email')} vs provided {email}")
+            return jsonify({"error": "Email verification failed"}), 401
+
+        async with write_session(0) as db_session:
+            user = await db_session.scalar(select(User).where(User.email == email))
+            if not user:
+                # bcrypt is CPU-bound; keep it off the event loop
+                password = await asyncio.to_thread(bcrypt.generate_password_hash, 'firebase_auth')
+                user = User(email=email, name=name or decoded_token.get('name', ''), password=password.decode('utf-8'))
+                db_session.add(user)
+                await db_session.commit()
+
+        login_user(user)
+
+        return jsonify({
+            "id": user.id,
+            "email": user.email,
+            "name": user.name
+        }), 200
+
+    except ValueError as e:
+        print(f"Firebase token verification error: {str(e)}")
+        return jsonify({"error": f"Invalid authentication token: {str(e)}"}), 401
+    except Exception as e:
+        print(f"Unexpected Firebase login error: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": "Authentication failed"}), 500
+
+
+# (endpoint, method) -> (view, login required)
+ASYNC_VIEWS = {
+    ('get_task_lists', 'GET'): (get_task_lists, True),
+    ('get_tasks', 'GET'): (get_tasks, True),
+    ('update_task', 'PUT'): (update_task, True),
+    ('firebase_login', 'POST'): (firebase_login, False),
+}
+
+
+async def dispatch(view, login_required, view_args):
+    """Run an async view like Flask's full_dispatch_request; None hands the request to the WSGI app."""
+    try:
+        try:
+            user = await load_current_user()
+            if user is None and login_required:
+                return None  # the sync app answers with the usual 401
+            # Read-your-writes for buffered task updates, as in flush_pending_task_updates
+            if user is not None and write_behind is not None and not is_coalesced_update() \
+                    and write_behind.has_pending(user.id):
+                await asyncio.to_thread(write_behind.flush, user.id)
+            rv = await view(**view_args)
+            if rv is None:
+                return None
+        except Exception as e:
+            rv = app.handle_user_exception(e)
+        return app.finalize_request(rv)
+    except Exception as e:
+        return app.handle_exception(e)
+
+
+async def send_response(response, send):
+    headers = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in response.headers.to_wsgi_list()]
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    try:
+        for chunk in response.iter_encoded():
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        response.close()
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def replay(body, receive):
+    """A receive callable that yields an already read body first."""
+    sent = False
+
+    async def replayed():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        return await receive()
+    return replayed
+
+
+wsgi_app = WSGIMiddleware(app, workers=ASGI_THREADS, send_queue_size=ASGI_THREADS)
+
+
+async def asgi_app(scope, receive, send):
+    if scope['type'] != 'http':
+        return await wsgi_app(scope, receive, send)
+
+    environ = build_environ(scope, io.BytesIO())
+    try:
+        endpoint, view_args = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        endpoint, view_args = None, None
+    if (endpoint, scope['method']) not in ASYNC_VIEWS:
+        return await wsgi_app(scope, receive, send)
+    view, login_required = ASYNC_VIEWS[(endpoint, scope['method'])]
+
+    body = await read_body(receive)
+    environ['wsgi.input'] = io.BytesIO(body)
+    ctx = app.request_context(environ)
+    ctx.push()
+    error = None
+    try:
+        response = await dispatch(view, login_required, view_args)
+        if response is not None:
+            await send_response(response, send)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        ctx.pop(error)
+    if response is None:
+        await wsgi_app(scope, replay(body, receive), send)
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from PIL import Image, ImageOps
+
+# Decoded formats we accept, mapped to the extension the original is stored under
+ALLOWED_FORMATS = {'PNG': 'png', 'JPEG': 'jpg', 'GIF': 'gif', 'WEBP': 'webp'}
+THUMBNAIL_SIZES = (64, 256)
+THUMBNAIL_FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+MAX_DIMENSION = 4096
+
+# Thumbnails are rendered here instead of on the request thread
+thumbnail_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='avatar-thumbnails')
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def decode_image(data):
+    """Fully decode uploaded bytes and return the PIL format name, or raise InvalidImage."""
+    try:
+        with Image.open(BytesIO(data)) as image:
+            image_format = image.format
+            width, height = image.size
+            if image_format not in ALLOWED_FORMATS:
+                raise InvalidImage("Unsupported image type")
+            if width > MAX_DIMENSION or height > MAX_DIMENSION:
+                raise InvalidImage("Image is too large")
+            image.load()
+    except InvalidImage:
+        raise
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        raise InvalidImage("File is not a valid image")
+    return image_format
+
+
+def avatar_dir(folder, digest):
+    return os.path.join(folder, digest)
+
+
+def original_path(folder, digest):
+    """Path of the stored original, whatever its extension, or None."""
+    directory = avatar_dir(folder, digest)
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith('original.'):
+                return os.path.join(directory, name)
+    return None
+
+
+def thumbnail_path(folder, digest, size, extension):
+    return os.path.join(avatar_dir(folder, digest), f"{size}.{extension}")
+
+
+def write_atomic(path, data):
+    """Write via a temp file and rename, so readers never see a partial file."""
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(handle, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def store_avatar(folder, data):
+    """Validate and store an upload under its content hash; return the digest.
+
+    Identical uploads map to the same directory, so they are stored once.
+    """
+    image_format = decode_image(data)
+    digest = hashlib.sha256(data).hexdigest()
+
+    if original_path(folder, digest) is None:
+        os.makedirs(avatar_dir(folder, digest), exist_ok=True)
+        write_atomic(os.path.join(avatar_dir(folder, digest), f"original.{ALLOWED_FORMATS[image_format]}"), data)
+
+    thumbnail_executor.submit(render_thumbnails, folder, digest)
+    return digest
+
+
+def render_thumbnail(folder, digest, size, extension):
+    path = thumbnail_path(folder, digest, size, extension)
+    if os.path.exists(path):
+        return path
+
+    with Image.open(original_path(folder, digest)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = ImageOps.fit(image.convert('RGBA'), (size, size), Image.LANCZOS)
+
+    if THUMBNAIL_FORMATS[extension] == 'JPEG':
+        # JPEG has no alpha channel; flatten onto white
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+
+    output = BytesIO()
+    image.save(output, THUMBNAIL_FORMATS[extension], quality=85)
+    write_atomic(path, output.getvalue())
+    return path
+
+
+def render_thumbnails(folder, digest):
+    for size in THUMBNAIL_SIZES:
+        for extension in THUMBNAIL_FORMATS:
+            try:
+                render_thumbnail(folder, digest, size, extension)
+            except Exception as e:
+                # Missing thumbnails are rendered on first request instead
+                print(f"Failed to render {size}.{extension} thumbnail for avatar {digest}: {e}")
+
+
+def remove_avatar(folder, digest):
+    shutil.rmtree(avatar_dir(folder, digest), ignore_errors=True)
+
+
+def stored_digests(folder):
+    """Digests of all avatars on disk."""
+    return [name for name in os.listdir(folder) if os.path.isdir(os.path.join(folder, name))]
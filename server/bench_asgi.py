@@ -0,0 +1,200 @@
+"""Compare the async ASGI (uvicorn) deployment with gunicorn under many connections.
+
+Modes: `sync` (gunicorn sync workers, one request per process), `gthread`
+(gunicorn threads, THREADS per process) and `asgi` (uvicorn; the benchmarked
+routes are asgi.py's async views, on the async engine with a pool of
+ASYNC_POOL connections per process). A sync or gthread worker holds a process
+or thread per request in flight, so their concurrency is capped at
+workers x threads; the async views only wait for a pooled connection, and the
+pool can be much larger than a thread pool.
+
+Each mode is started against a fresh SQLite database in a temp directory,
+seeded with one user and a task list, then hit by N concurrent keep-alive
+connections issuing a TaskPage-like mix of list loads and task toggles. The app needs the
+same environment as `python app.py` (FIREBASE_CREDENTIALS etc.).
+
+    python bench_asgi.py --connections 50,200,500 --duration 15 --workers 2
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+HOST = '127.0.0.1'
+
+
+def server_command(mode, port, workers, threads):
+    if mode == 'sync':
+        return ['gunicorn', '--workers', str(workers), '--bind', f'{HOST}:{port}', 'app:app']
+    if mode == 'gthread':
+        return ['gunicorn', '--worker-class', 'gthread', '--workers', str(workers), '--threads', str(threads),
+                '--bind', f'{HOST}:{port}', 'app:app']
+    return ['uvicorn', 'asgi:asgi_app', '--host', HOST, '--port', str(port),
+            '--workers', str(workers), '--no-access-log']
+
+
+def start_server(mode, port, workers, threads, async_pool, db_dir):
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(db_dir, 'bench.db')}",
+        'ASGI_THREADS': str(threads),
+        'DB_POOL_SIZE': str(threads),
+        'ASYNC_DB_POOL_SIZE': str(async_pool),
+        'RATE_LIMITS': '{}',  # measure the server, not the rate limiter
+        # Workers must share cache invalidations
+        'RESPONSE_CACHE_BACKEND': 'sqlite',
+        'RESPONSE_CACHE_URL': os.path.join(db_dir, 'response_cache.db'),
+    })
+    process = subprocess.Popen(server_command(mode, port, workers, threads),
+                               cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    for _ in range(100):
+        try:
+            request(http.client.HTTPConnection(HOST, port, timeout=1), 'GET', '/api/user')
+            return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    process.wait(timeout=30)
+
+
+def request(conn, method, path, body=None, cookie=None):
+    headers = {'Content-Type': 'application/json'}
+    if cookie:
+        headers['Cookie'] = cookie
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    return response.status, response.getheader('Set-Cookie'), data
+
+
+def seed(port, tasks):
+    """Create a user with one list of `tasks` tasks; return (session cookie, list id, task ids)."""
+    conn = http.client.HTTPConnection(HOST, port, timeout=30)
+    credentials = {'email': 'bench@example.com', 'password': 'bench-password'}
+    request(conn, 'POST', '/api/register', credentials)
+    _, set_cookie, _ = request(conn, 'POST', '/api/login', credentials)
+    cookie = set_cookie.split(';', 1)[0]
+
+    _, _, data = request(conn, 'POST', '/api/task-lists', {'title': 'Benchmark'}, cookie)
+    list_id = json.loads(data)['id']
+    task_ids = []
+    for i in range(tasks):
+        _, _, data = request(conn, 'POST', f'/api/task-lists/{list_id}/tasks', {'title': f'Task {i}'}, cookie)
+        task_ids.append(json.loads(data)['id'])
+    return cookie, list_id, task_ids
+
+
+def client(args):
+    """One client process: `connections` threads of keep-alive requests until `deadline`."""
+    import threading
+    port, connections, deadline, cookie, list_id, task_ids = args
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def run():
+        conn = http.client.HTTPConnection(HOST, port, timeout=30)
+        local_latencies, local_errors = [], 0
+        while time.time() < deadline:
+            roll = random.random()
+            if roll < 0.6:
+                method, path, body = 'GET', f'/api/task-lists/{list_id}/tasks', None
+            elif roll < 0.8:
+                method, path, body = 'GET', '/api/task-lists', None
+            else:
+                method, path, body = 'PUT', f'/api/tasks/{random.choice(task_ids)}', {'completed': random.random() < 0.5}
+            start = time.perf_counter()
+            try:
+                status, _, _ = request(conn, method, path, body, cookie)
+                if status >= 400:
+                    local_errors += 1
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection(HOST, port, timeout=30)
+            local_latencies.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=run) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+
+def run_load(port, connections, duration, seed_data, client_processes):
+    deadline = time.time() + duration
+    per_process = [connections // client_processes + (1 if i < connections % client_processes else 0)
+                   for i in range(client_processes)]
+    jobs = [(port, n, deadline) + seed_data for n in per_process if n]
+    with multiprocessing.Pool(len(jobs)) as pool:
+        results = pool.map(client, jobs)
+    latencies = sorted(latency for result in results for latency in result[0])
+    errors = sum(result[1] for result in results)
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / duration, 1),
+        'error_rate': round(errors / len(latencies), 4) if latencies else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='sync,gthread,asgi')
+    parser.add_argument('--connections', default='50,200')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=2, help='server processes in every mode')
+    parser.add_argument('--threads', type=int, default=16, help='gthread threads (and ASGI_THREADS) per process')
+    parser.add_argument('--async-pool', type=int, default=8, help='async engine connections per process (SQLite)')
+    parser.add_argument('--tasks', type=int, default=200, help='tasks in the seeded list')
+    parser.add_argument('--client-processes', type=int, default=4)
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes.split(','):
+        db_dir = tempfile.mkdtemp(prefix=f'bench-{mode}-')
+        process = start_server(mode, args.port, args.workers, args.threads, args.async_pool, db_dir)
+        try:
+            seed_data = seed(args.port, args.tasks)
+            for connections in (int(n) for n in args.connections.split(',')):
+                result = run_load(args.port, connections, args.duration, seed_data, args.client_processes)
+                result.update(mode=mode, connections=connections)
+                results.append(result)
+                print(json.dumps(result), file=sys.stderr)
+        finally:
+            stop_server(process)
+            shutil.rmtree(db_dir, ignore_errors=True)
+
+    columns = ['mode', 'connections', 'requests', 'rps', 'error_rate', 'p50_ms', 'p95_ms', 'p99_ms']
+    print(' '.join(f'{column:>11}' for column in columns))
+    for result in results:
+        print(' '.join(f'{str(result[column]):>11}' for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """In-process LRU cache bounded by the serialized size of its values, with optional expiry."""
+
+    def __init__(self, max_bytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, size, expires_at)
+        self.bytes = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] is not None and entry[2] <= time.time():
+                del self.entries[key]
+                self.bytes -= entry[1]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, size):
+        # A single value bigger than the whole cache is never worth keeping
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self.entries[key] = (value, size, time.time() + self.ttl if self.ttl else None)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+
+def server_worker_count(argv, environ):
+    """Worker processes requested on a gunicorn/uvicorn command line or via WEB_CONCURRENCY.
+
+    Workers inherit the server's argv (forked, or restored by multiprocessing's spawn),
+    so this works from inside a worker. Returns 1 when nothing says otherwise.
+    """
+    for i, arg in enumerate(argv):
+        if arg in ('-w', '--workers') and i + 1 < len(argv):
+            return int(argv[i + 1])
+        if arg.startswith('--workers='):
+            return int(arg.split('=', 1)[1])
+    return int(environ.get('WEB_CONCURRENCY', 1))
+
+
+class SQLiteBackend:
+    """Shared cache backend in a local SQLite file.
+
+    Stand-in for Redis when several worker processes on one machine should share
+    cached payloads and list versions.
+    """
+
+    # Expired entries are never served; they are deleted once per this many sets per process
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self.local = threading.local()
+        self.sets = 0
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_entry (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entry_expires_at ON cache_entry (expires_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_version (key TEXT PRIMARY KEY, version INTEGER)")
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self.connection().execute(
+            "SELECT value FROM cache_entry WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value):
+        conn = self.connection()
+        now = time.time()
+        conn.execute("INSERT OR REPLACE INTO cache_entry VALUES (?, ?, ?)", (key, value, now + self.ttl))
+        # Unlocked: a lost increment only delays the next prune slightly
+        self.sets += 1
+        if self.sets % self.PRUNE_EVERY == 0:
+            conn.execute("DELETE FROM cache_entry WHERE expires_at <= ?", (now,))
+
+    def get_version(self, key):
+        row = self.connection().execute("SELECT version FROM cache_version WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def incr_version(self, key):
+        self.connection().execute(
+            "INSERT INTO cache_version VALUES (?, 1) ON CONFLICT(key) DO UPDATE SET version = version + 1", (key,)
+        )
+
+
+class RedisBackend:
+    """Shared cache backend in Redis (requires the `redis` package)."""
+
+    def __init__(self, url, ttl=3600):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value):
+        self.client.set(key, value, ex=self.ttl)
+
+    def get_version(self, key):
+        return int(self.client.get(key) or 0)
+
+    def incr_version(self, key):
+        self.client.incr(key)
+
+
+class ResponseCache:
+    """Cache for per-list response payloads.
+
+    Keys include a version number per task list. Write routes bump the version of
+    every list they touch, so stale payloads are never served again, even ones that
+    a slow concurrent reader stores after the write. With a shared backend the
+    versions live there, so a write in one worker invalidates all of them. With the
+    local backend each worker only sees its own writes; other workers' entries go
+    stale until they expire after the TTL.
+    """
+
+    def __init__(self, max_bytes, shared=None, ttl=None):
+        self.local = LRUCache(max_bytes, ttl)
+        self.shared = shared
+        self.versions = {}  # list_id -> version, when there is no shared backend
+        self.versions_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    @classmethod
+    def from_config(cls, config):
+        backend = config.get('RESPONSE_CACHE_BACKEND', 'local')
+        shared = None
+        if backend == 'sqlite':
+            shared = SQLiteBackend(config['RESPONSE_CACHE_URL'], ttl=config['RESPONSE_CACHE_TTL'])
+        elif backend == 'redis':
+            shared = RedisBackend(config['RESPONSE_CACHE_URL'], ttl=config['RESPONSE_CACHE_TTL'])
+        elif server_worker_count(sys.argv, os.environ) > 1:
+            print("Warning: RESPONSE_CACHE_BACKEND=local with several worker processes; a write in one "
+                  "worker is not seen by the others' caches for up to RESPONSE_CACHE_TTL seconds. "
+                  "Use the sqlite or redis backend.")
+        return cls(config['RESPONSE_CACHE_MAX_BYTES'], shared=shared, ttl=config['RESPONSE_CACHE_TTL'])
+
+    def version(self, list_id):
+        if self.shared is not None:
+            return self.shared.get_version(f"version:{list_id}")
+        return self.versions.get(list_id, 0)
+
+    def key(self, kind, user_id, list_id, *variant):
+        parts = [kind, user_id, list_id, self.version(list_id)] + list(variant)
+        return ':'.join(str(part) for part in parts)
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            data = self.shared.get(key)
+            if data is not None:
+                value = json.loads(data)
+                self.local.set(key, value, len(data))
+                self.shared_hits += 1
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        data = json.dumps(value, separators=(',', ':'))
+        self.local.set(key, value, len(data))
+        if self.shared is not None:
+            self.shared.set(key, data)
+
+    def invalidate(self, *list_ids):
+        for list_id in set(list_ids):
+            if list_id is None:
+                continue
+            if self.shared is not None:
+                self.shared.incr_version(f"version:{list_id}")
+            else:
+                with self.versions_lock:
+                    self.versions[list_id] = self.versions.get(list_id, 0) + 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.shared).__name__ if self.shared is not None else "local",
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_hits": self.shared_hits,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "entries": len(self.local.entries),
+            "bytes": self.local.bytes,
+            "max_bytes": self.local.max_bytes,
+            "evictions": self.local.evictions
+        }
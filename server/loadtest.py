@@ -0,0 +1,284 @@
+"""Load test the API under multi-worker gunicorn profiles with a mixed workload.
+
+A local SQLite database is seeded once with several users, each with a few task
+lists of tasks spread over the last 59 days. Every profile then gets its own
+copy of it and is hit by N concurrent keep-alive clients, each logged in as one
+of the seeded users and replaying a TaskPage-like mix:
+
+    toggle  PUT /api/tasks/<id> flipping `completed`
+    tasks   GET /api/task-lists/<id>/tasks
+    lists   GET /api/task-lists
+    stats   GET /api/stats/tasks/weekly|monthly|high-priority
+    login   POST /api/login (bcrypt check, new session cookie)
+
+Profiles are <worker class>:<workers>[x<threads>], where threads are gthread
+threads or gevent worker connections. The app needs the same environment as
+`python app.py` (FIREBASE_CREDENTIALS etc.); the gevent profile needs gevent.
+
+    python loadtest.py --profiles sync:4,gthread:4x8,gevent:4x100 --connections 64 --duration 20
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from bench_asgi import HOST, request, stop_server, percentile
+from routing import copy_sqlite_database
+
+PASSWORD = 'loadtest-password'
+# Share of requests per operation; the rest of the mix is list loads
+WORKLOAD = {'toggle': 0.35, 'lists': 0.15, 'stats': 0.10, 'login': 0.05}
+STATS_PATHS = ['/api/stats/tasks/weekly', '/api/stats/tasks/monthly', '/api/stats/tasks/high-priority']
+
+
+def parse_profile(spec):
+    """'gthread:4x8' -> ('gthread', 4, 8)"""
+    worker_class, _, size = spec.partition(':')
+    workers, _, threads = (size or '2').partition('x')
+    return worker_class, int(workers), int(threads or 1)
+
+
+def server_command(port, worker_class, workers, threads):
+    command = ['gunicorn', '--worker-class', worker_class, '--workers', str(workers),
+               '--bind', f'{HOST}:{port}', '--timeout', '60']
+    if worker_class == 'gthread':
+        command += ['--threads', str(threads)]
+    elif worker_class == 'gevent':
+        command += ['--worker-connections', str(threads)]
+    return command + ['app:app']
+
+
+def start_server(port, profile, db_path):
+    worker_class, workers, threads = profile
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': f'sqlite:///{db_path}',
+        'DB_POOL_SIZE': str(threads),  # one connection per request thread or greenlet
+        'RATE_LIMITS': '{}',  # measure the server, not the rate limiter
+        # Keep the archive sweep from moving seeded tasks away mid-run (toggles on them would 404)
+        'ARCHIVE_COMPLETED_AFTER_DAYS': '3650',
+        # Workers must share cache invalidations
+        'RESPONSE_CACHE_BACKEND': 'sqlite',
+        'RESPONSE_CACHE_URL': os.path.join(os.path.dirname(db_path), 'response_cache.db'),
+    })
+    process = subprocess.Popen(server_command(port, worker_class, workers, threads),
+                               cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    for _ in range(100):
+        if process.poll() is not None:
+            break
+        try:
+            request(http.client.HTTPConnection(HOST, port, timeout=1), 'GET', '/api/user')
+            return process
+        except OSError:
+            time.sleep(0.2)
+    if process.poll() is None:
+        stop_server(process)
+    raise RuntimeError(f"gunicorn {worker_class} server did not start")
+
+
+def seed_database(db_path, users, lists, tasks):
+    """Write the seeded database; return [(email, list ids, task ids)] per user.
+
+    Runs in a spawned process, since importing the app initializes Firebase and the database.
+    """
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    from datetime import datetime, timedelta
+    from app import app, bcrypt
+    from models import db, User, TaskList, Task
+
+    now = datetime.utcnow()
+    password = bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    seeded = []
+    with app.app_context():
+        for i in range(users):
+            user = User(email=f'load{i}@example.com', password=password, name=f'Load {i}')
+            task_lists = [TaskList(title=f'List {n}', owner=user) for n in range(lists)]
+            db.session.add(user)
+            db.session.flush()
+
+            rows = []
+            for task_list in task_lists:
+                for n in range(tasks):
+                    created_at = now - timedelta(days=random.randint(0, 58), minutes=random.randint(0, 1440))
+                    rows.append(dict(
+                        title=f'Task {n}',
+                        task_list_id=task_list.id,
+                        completed=random.random() < 0.4,
+                        priority=random.choice(['high', 'medium', 'low', None]),
+                        due_date=now + timedelta(days=random.randint(-10, 30)) if random.random() < 0.5 else None,
+                        created_at=created_at,
+                        updated_at=created_at
+                    ))
+            db.session.execute(db.insert(Task), rows)
+            db.session.commit()
+
+            list_ids = [task_list.id for task_list in task_lists]
+            task_ids = db.session.scalars(db.select(Task.id).where(Task.task_list_id.in_(list_ids))).all()
+            seeded.append((user.email, list_ids, task_ids))
+    return seeded
+
+
+def session_cookie(set_cookie, cookie):
+    if set_cookie and set_cookie.startswith('session='):
+        return set_cookie.split(';', 1)[0]
+    return cookie
+
+
+def pick_operation(list_ids, task_ids):
+    roll = random.random()
+    for operation, share in WORKLOAD.items():
+        if roll < share:
+            break
+        roll -= share
+    else:
+        operation = 'tasks'
+
+    if operation == 'toggle':
+        return operation, 'PUT', f'/api/tasks/{random.choice(task_ids)}', {'completed': random.random() < 0.5}
+    if operation == 'lists':
+        return operation, 'GET', '/api/task-lists', None
+    if operation == 'stats':
+        return operation, 'GET', random.choice(STATS_PATHS), None
+    if operation == 'tasks':
+        return operation, 'GET', f'/api/task-lists/{random.choice(list_ids)}/tasks', None
+    return operation, 'POST', '/api/login', None
+
+
+def client(args):
+    """One client process: `connections` threads, each acting as one of the logged-in users."""
+    import threading
+    port, connections, deadline, sessions = args
+    samples, lock = [], threading.Lock()
+
+    def run(email, cookie, list_ids, task_ids):
+        conn = http.client.HTTPConnection(HOST, port, timeout=60)
+        credentials = {'email': email, 'password': PASSWORD}
+        local_samples = []
+        while time.time() < deadline:
+            operation, method, path, body = pick_operation(list_ids, task_ids)
+            if operation == 'login':
+                body = credentials
+            sent = time.perf_counter()
+            try:
+                status, set_cookie, _ = request(conn, method, path, body, cookie)
+                cookie = session_cookie(set_cookie, cookie)
+                ok = status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection(HOST, port, timeout=60)
+            local_samples.append((operation, time.perf_counter() - sent, ok))
+        with lock:
+            samples.extend(local_samples)
+
+    threads = [threading.Thread(target=run, args=random.choice(sessions)) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def summarize(samples, duration):
+    latencies = sorted(latency for _, latency, _ in samples)
+    errors = sum(1 for _, _, ok in samples if not ok)
+    return {
+        'requests': len(samples),
+        'rps': round(len(samples) / duration, 1),
+        'error_rate': round(errors / len(samples), 4) if samples else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'max_ms': round(latencies[-1] * 1000, 1) if latencies else 0,
+    }
+
+
+def log_in(port, users):
+    """Log each seeded user in once; clients share these session cookies."""
+    conn = http.client.HTTPConnection(HOST, port, timeout=60)
+    sessions = []
+    for email, list_ids, task_ids in users:
+        _, set_cookie, _ = request(conn, 'POST', '/api/login', {'email': email, 'password': PASSWORD})
+        sessions.append((email, session_cookie(set_cookie, None), list_ids, task_ids))
+    return sessions
+
+
+def run_load(port, connections, duration, sessions, client_processes):
+    deadline = time.time() + duration
+    per_process = [connections // client_processes + (1 if i < connections % client_processes else 0)
+                   for i in range(client_processes)]
+    jobs = [(port, n, deadline, sessions) for n in per_process if n]
+    with multiprocessing.Pool(len(jobs)) as pool:
+        samples = [sample for result in pool.map(client, jobs) for sample in result]
+
+    result = summarize(samples, duration)
+    # Per-operation tails show which part of the mix (e.g. bcrypt logins, SQLite writes) is contended
+    result['operations'] = {
+        operation: summarize([sample for sample in samples if sample[0] == operation], duration)
+        for operation in sorted({sample[0] for sample in samples})
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', default='sync:4,gthread:4x8,gevent:4x100')
+    parser.add_argument('--connections', default='32,128', help='concurrent clients, comma separated')
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--lists', type=int, default=3, help='task lists per user')
+    parser.add_argument('--tasks', type=int, default=100, help='tasks per list')
+    parser.add_argument('--client-processes', type=int, default=4)
+    parser.add_argument('--port', type=int, default=5056)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='loadtest-')
+    template = os.path.join(work_dir, 'seed.db')
+    results = []
+    try:
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            users = pool.apply(seed_database, (template, args.users, args.lists, args.tasks))
+
+        for spec in args.profiles.split(','):
+            profile = parse_profile(spec)
+            for connections in (int(n) for n in args.connections.split(',')):
+                # Each run starts from the same seeded data
+                db_path = os.path.join(work_dir, 'run.db')
+                for name in ('run.db', 'response_cache.db'):
+                    for suffix in ('', '-wal', '-shm'):
+                        if os.path.exists(os.path.join(work_dir, name + suffix)):
+                            os.remove(os.path.join(work_dir, name + suffix))
+                # The seed database is in WAL mode, so copy it with the backup API rather than the file
+                copy_sqlite_database(f'sqlite:///{template}', f'sqlite:///{db_path}')
+                try:
+                    process = start_server(args.port, profile, db_path)
+                except RuntimeError as e:
+                    print(e, file=sys.stderr)
+                    break
+                try:
+                    result = run_load(args.port, connections, args.duration, log_in(args.port, users),
+                                      args.client_processes)
+                finally:
+                    stop_server(process)
+                result.update(profile=spec, connections=connections)
+                results.append(result)
+                print(json.dumps(result), file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    columns = ['profile', 'connections', 'requests', 'rps', 'error_rate', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+    print(' '.join(f'{column:>12}' for column in columns))
+    for result in results:
+        print(' '.join(f'{str(result[column]):>12}' for column in columns))
+
+
+if __name__ == '__main__':
+    main()
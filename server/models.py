@@ -1,8 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy import case, inspect
+from sqlalchemy.orm import validates
+from routing import RoutingSession
 
-db = SQLAlchemy()
+# RoutingSession sends queries to the user's shard and GET reads to replicas when configured
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Updated User model with additional profile fields
 
@@ -39,6 +43,36 @@ class TaskList(db.Model):
     tasks = db.relationship('Task', backref='task_list', lazy=True, cascade="all, delete-orphan")
     children = db.relationship('TaskList', backref=db.backref('parent', remote_side=[id]), lazy=True)
 
+    # Partial index so the default (non-archived) sidebar query never touches archived lists
+    __table_args__ = (
+        db.Index('ix_task_list_user_active', 'user_id', 'parent_id',
+                 sqlite_where=db.text('is_archived = 0'),
+                 postgresql_where=db.text('is_archived = false')),
+    )
+
+# Sortable rank for the free-form priority strings; lower comes first.
+# Tasks without a priority are shown as 'medium' by the client and ranked the same.
+PRIORITY_RANKS = {'high': 0, 'medium': 1, 'low': 2}
+DEFAULT_PRIORITY_RANK = PRIORITY_RANKS['medium']
+UNKNOWN_PRIORITY_RANK = 3
+
+def priority_rank_for(priority):
+    if priority is None:
+        return DEFAULT_PRIORITY_RANK
+    return PRIORITY_RANKS.get(priority, UNKNOWN_PRIORITY_RANK)
+
+def default_priority_rank(context):
+    # Column default, so bulk inserts that bypass the ORM validator still get a rank
+    return priority_rank_for(context.get_current_parameters().get('priority'))
+
+def priority_rank_expression(priority_column):
+    """SQL equivalent of priority_rank_for(), for backfills and INSERT ... SELECT."""
+    return case(
+        *[(priority_column == priority, rank) for priority, rank in PRIORITY_RANKS.items()],
+        (priority_column.is_(None), DEFAULT_PRIORITY_RANK),
+        else_=UNKNOWN_PRIORITY_RANK
+    )
+
 class Task(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
@@ -47,6 +81,8 @@ class Task(db.Model):
     parent_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=True)
     level = db.Column(db.Integer, default=0)
     priority = db.Column(db.String(20), nullable=True)
+    # Kept in sync with `priority` so the "what's next" queue can be read in index order
+    priority_rank = db.Column(db.Integer, nullable=True, default=default_priority_rank)
     due_date = db.Column(db.DateTime, nullable=True)
     tags = db.Column(db.String(255), nullable=True)
     task_list_id = db.Column(db.Integer, db.ForeignKey('task_list.id'), nullable=False)
@@ -57,4 +93,86 @@ class Task(db.Model):
     children = db.relationship('Task', 
                               backref=db.backref('parent', remote_side=[id]),
                               lazy=True, 
-                              cascade="all, delete-orphan")
\ No newline at end of file
+                              cascade="all, delete-orphan")
+
+    @validates('priority')
+    def update_priority_rank(self, key, priority):
+        self.priority_rank = priority_rank_for(priority)
+        return priority
+
+    __table_args__ = (
+        # Serves both "top-level tasks of a list" and "children of a task" page queries
+        db.Index('ix_task_list_parent', 'task_list_id', 'parent_id'),
+        # Open tasks of a list in "do next" order: priority, then due date with undated tasks last
+        db.Index('ix_task_next', task_list_id, completed, priority_rank, due_date.is_(None), due_date),
+        # Never reuse ids of deleted/archived tasks on new SQLite databases, so archived
+        # history can't be confused with live tasks
+        {'sqlite_autoincrement': True},
+    )
+
+# Cold storage for tasks moved out of the hot `task` table, either because they
+# were completed long ago or because their list was archived
+class TaskArchive(db.Model):
+    __tablename__ = 'task_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, nullable=False)  # Original task id
+    title = db.Column(db.String(255), nullable=False)
+    completed = db.Column(db.Boolean, default=False)
+    description = db.Column(db.Text, nullable=True)
+    parent_id = db.Column(db.Integer, nullable=True)
+    level = db.Column(db.Integer, default=0)
+    priority = db.Column(db.String(20), nullable=True)
+    due_date = db.Column(db.DateTime, nullable=True)
+    tags = db.Column(db.String(255), nullable=True)
+    task_list_id = db.Column(db.Integer, db.ForeignKey('task_list.id'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 'completed' for the age-based sweep, 'list' when the whole list was archived
+    reason = db.Column(db.String(20), nullable=False, default='completed')
+
+# (Task column, TaskArchive column) pairs, used for INSERT ... SELECT moves
+ARCHIVE_COLUMNS = [('id', 'task_id')] + [
+    (name, name) for name in ('title', 'completed', 'description', 'parent_id', 'level', 'priority',
+                              'due_date', 'tags', 'task_list_id', 'created_at', 'updated_at')
+]
+
+def shard_metadata(sharded_tables):
+    """Copies of the sharded tables for the extra shards, without foreign keys to
+    tables that only live on shard 0 (task_list.user_id -> user)."""
+    metadata = db.MetaData()
+    for name in sharded_tables:
+        db.metadata.tables[name].to_metadata(metadata)
+    for table in metadata.tables.values():
+        for constraint in list(table.foreign_key_constraints):
+            if constraint.elements[0].target_fullname.split('.')[0] not in sharded_tables:
+                table.constraints.discard(constraint)
+                for foreign_key in constraint.elements:
+                    foreign_key.parent.foreign_keys.discard(foreign_key)
+                    table.foreign_keys.discard(foreign_key)
+    return metadata
+
+def index_names(engine):
+    """Names of the existing indexes. SQLite reflection skips expression indexes, so ask it directly."""
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as conn:
+            return set(conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'").scalars())
+    inspector = inspect(engine)
+    return {index['name'] for table in inspector.get_table_names() for index in inspector.get_indexes(table)}
+
+def upgrade_schema(engine):
+    """Add columns and indexes that db.create_all() skips on tables that already exist."""
+    task_columns = {column['name'] for column in inspect(engine).get_columns('task')}
+    with engine.begin() as conn:
+        if 'priority_rank' not in task_columns:
+            conn.exec_driver_sql('ALTER TABLE task ADD COLUMN priority_rank INTEGER')
+        conn.execute(Task.__table__.update().where(Task.priority_rank.is_(None)).values(
+            priority_rank=priority_rank_expression(Task.priority)))
+        conn.execute(TaskList.__table__.update().where(TaskList.is_archived.is_(None)).values(is_archived=False))
+
+    existing = index_names(engine)
+    for table in (TaskList.__table__, Task.__table__, TaskArchive.__table__):
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
@@ -0,0 +1,135 @@
+import math
+import sqlite3
+import threading
+import time
+
+
+def parse_limit(limit):
+    """Parse '60/minute' into (capacity, tokens per second)."""
+    count, period = limit.split('/')
+    seconds = {'second': 1, 'minute': 60, 'hour': 3600}[period.strip()]
+    count = int(count)
+    return count, count / seconds
+
+
+class MemoryBucketStore:
+    """Token buckets kept in this process."""
+
+    def __init__(self):
+        self.buckets = {}  # key -> (tokens, updated_at)
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now):
+        with self.lock:
+            tokens, updated_at = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            return allowed, tokens
+
+
+class SQLiteBucketStore:
+    """Token buckets in a SQLite file, shared by the worker processes on one machine."""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS rate_bucket (key TEXT PRIMARY KEY, tokens REAL, updated_at REAL)"
+        )
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    def take(self, key, capacity, rate, now):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM rate_bucket WHERE key = ?", (key,)).fetchone()
+            tokens, updated_at = row if row else (capacity, now)
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute("INSERT OR REPLACE INTO rate_bucket VALUES (?, ?, ?)", (key, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, tokens
+
+
+class RateLimiter:
+    """Token-bucket rate limiter with named limits, e.g. {'stats': '30/minute'}."""
+
+    def __init__(self, limits, store):
+        self.limits = {name: parse_limit(limit) for name, limit in limits.items()}
+        self.store = store
+
+    @classmethod
+    def from_config(cls, config):
+        if config['RATE_LIMIT_BACKEND'] == 'sqlite':
+            store = SQLiteBucketStore(config['RATE_LIMIT_URL'])
+        else:
+            store = MemoryBucketStore()
+        return cls(config['RATE_LIMITS'], store)
+
+    def hit(self, name, key):
+        """Take a token for `key` under limit `name`. Returns (allowed, retry_after seconds)."""
+        if name not in self.limits:
+            return True, 0
+        capacity, rate = self.limits[name]
+        allowed, tokens = self.store.take(f"{name}:{key}", capacity, rate, time.time())
+        if allowed:
+            return True, 0
+        return False, max(1, math.ceil((1 - tokens) / rate))
+
+
+class SingleFlight:
+    """Run identical concurrent calls once and hand the result to every caller."""
+
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = self.Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
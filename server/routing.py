@@ -0,0 +1,140 @@
+import json
+import random
+import sqlite3
+import time
+import sqlalchemy as sa
+from sqlalchemy.sql.util import find_tables
+from flask import current_app, g, has_request_context, request, session as cookie_session
+from flask_login import current_user
+from flask_sqlalchemy.session import Session
+
+# Tables that hold per-user data and live on the user's shard; everything else stays on the primary
+SHARDED_TABLES = {'task_list', 'task', 'task_archive'}
+READ_METHODS = {'GET', 'HEAD'}
+# Flask session key holding the time until which this client reads from primaries
+STICKY_SESSION_KEY = '_primary_until'
+
+
+class DatabaseRouter:
+    """Maps queries to a shard (by user id) and to a primary or replica bind.
+
+    Shard 0 is the default database (SQLALCHEMY_DATABASE_URI); extra shards and
+    replicas are registered as Flask-SQLAlchemy binds named shard_<n> and
+    replica_<shard>_<i>. With no shards or replicas configured every query goes
+    to the default database, as before.
+    """
+
+    def __init__(self, shard_uris, replica_uris, sticky_seconds):
+        self.shard_count = 1 + len(shard_uris)
+        self.sticky_seconds = sticky_seconds
+        self.binds = {}
+        for shard, uri in enumerate(shard_uris, start=1):
+            self.binds[self.shard_bind_key(shard)] = uri
+        self.replica_keys = {}
+        for shard, uris in replica_uris.items():
+            keys = self.replica_keys.setdefault(shard, [])
+            for i, uri in enumerate(uris):
+                keys.append(f"replica_{shard}_{i}")
+                self.binds[keys[-1]] = uri
+
+    @classmethod
+    def from_env(cls, environ):
+        """Read DATABASE_SHARDS (JSON list of URIs) and DATABASE_REPLICAS (JSON list of
+        replica URIs for shard 0, or an object mapping shard number to a list)."""
+        shards = json.loads(environ.get('DATABASE_SHARDS', '[]'))
+        replicas = json.loads(environ.get('DATABASE_REPLICAS', '[]'))
+        if isinstance(replicas, list):
+            replicas = {0: replicas}
+        replicas = {int(shard): uris for shard, uris in replicas.items() if uris}
+        return cls(shards, replicas, float(environ.get('REPLICA_STICKY_SECONDS', 5)))
+
+    @property
+    def has_replicas(self):
+        return bool(self.replica_keys)
+
+    @staticmethod
+    def shard_bind_key(shard):
+        return None if shard == 0 else f"shard_{shard}"
+
+    def shard_for_user(self, user_id):
+        return user_id % self.shard_count
+
+    def shards(self):
+        return range(self.shard_count)
+
+    def bind_key(self, shard, read_only):
+        if read_only and shard in self.replica_keys:
+            return random.choice(self.replica_keys[shard])
+        return self.shard_bind_key(shard)
+
+
+def use_primary():
+    """Read from primaries for the rest of this request, e.g. before a read-then-write."""
+    g.use_primary = True
+
+
+def replica_reads_allowed(router):
+    if not router.has_replicas or not has_request_context():
+        return False
+    if request.method not in READ_METHODS or g.get('use_primary'):
+        return False
+    # Read-your-writes: a client that just wrote reads from the primary for a while
+    return cookie_session.get(STICKY_SESSION_KEY, 0) < time.time()
+
+
+def remember_write(router, response):
+    """after_request hook: pin this client to primaries after a successful mutation."""
+    if router.has_replicas and request.method not in READ_METHODS | {'OPTIONS'} and response.status_code < 400:
+        cookie_session[STICKY_SESSION_KEY] = time.time() + router.sticky_seconds
+    return response
+
+
+def statement_tables(mapper, clause):
+    if mapper is not None:
+        return {sa.inspect(mapper).local_table.name}
+    if clause is not None:
+        return {table.name for table in find_tables(clause, include_crud=True, include_joins=True)
+                if isinstance(table, sa.Table)}
+    return set()
+
+
+class RoutingSession(Session):
+    """Session that sends each statement to the right shard, and reads in GET
+    requests to a replica of it.
+
+    Set `session.info['shard']` to address a shard explicitly outside of a user's
+    request, e.g. in CLI commands.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        router = current_app.extensions.get('db_router') if bind is None else None
+        if router is None:
+            return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+        shard = 0
+        if statement_tables(mapper, clause) & SHARDED_TABLES:
+            shard = self.current_shard(router)
+
+        # Once this session has written, keep it on the primary so it sees its own writes
+        if self._flushing or (clause is not None and getattr(clause, 'is_dml', False)):
+            self.info['wrote'] = True
+        read_only = not self.info.get('wrote') and replica_reads_allowed(router)
+
+        return self._db.engines[router.bind_key(shard, read_only)]
+
+    def current_shard(self, router):
+        if 'shard' in self.info:
+            return self.info['shard']
+        if has_request_context() and current_user.is_authenticated:
+            return router.shard_for_user(current_user.id)
+        return 0
+
+
+def copy_sqlite_database(source_uri, target_uri):
+    """Copy one SQLite database file over another with the online backup API."""
+    source = sqlite3.connect(sa.engine.make_url(source_uri).database)
+    target = sqlite3.connect(sa.engine.make_url(target_uri).database)
+    with target:
+        source.backup(target)
+    source.close()
+    target.close()
@@ -0,0 +1,50 @@
+import itertools
+import json
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+emails = (f'user{n}@example.com' for n in itertools.count())
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """The app module, on two fresh SQLite shards with write-behind enabled.
+
+    The interval is long enough that the background flusher never runs during a test.
+    """
+    data_dir = tmp_path_factory.mktemp('data')
+    os.environ.update({
+        'DATABASE_URL': f'sqlite:///{data_dir / "shard0.db"}',
+        'DATABASE_SHARDS': json.dumps([f'sqlite:///{data_dir / "shard1.db"}']),
+        'WRITE_BEHIND': '1',
+        'WRITE_BEHIND_INTERVAL': '3600',
+        'RATE_LIMITS': '{}',
+        'FIREBASE_CREDENTIALS': '{}',
+    })
+    with mock.patch('firebase_admin.credentials.Certificate'), mock.patch('firebase_admin.initialize_app'):
+        import app
+    return app
+
+
+@pytest.fixture(autouse=True)
+def empty_write_behind(app_module):
+    yield
+    app_module.write_behind.pending.clear()
+    app_module.write_behind.dead_letters.clear()
+
+
+@pytest.fixture
+def make_client(app_module):
+    """Register and log in a new user; returns (test client, user id)."""
+    def make():
+        client = app_module.app.test_client()
+        email = next(emails)
+        client.post('/api/register', json={'email': email, 'password': 'secret'})
+        user = client.post('/api/login', json={'email': email, 'password': 'secret'}).get_json()
+        return client, user['id']
+    return make
@@ -0,0 +1,156 @@
+import asyncio
+import json
+from unittest import mock
+
+import pytest
+
+from models import db, Task
+
+
+class ASGIClient:
+    """Minimal HTTP client for the ASGI app, keeping the session cookie like a browser."""
+
+    def __init__(self, asgi_app, loop):
+        self.asgi_app = asgi_app
+        self.loop = loop
+        self.cookie = None
+
+    def request(self, method, path, body=None):
+        path, _, query = path.partition('?')
+        data = json.dumps(body).encode() if body is not None else b''
+        headers = [(b'host', b'localhost'), (b'content-type', b'application/json'),
+                   (b'content-length', str(len(data)).encode())]
+        if self.cookie:
+            headers.append((b'cookie', self.cookie.encode()))
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+                 'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                 'root_path': '', 'headers': headers, 'client': ('127.0.0.1', 50000), 'server': ('localhost', 80)}
+        messages = [{'type': 'http.request', 'body': data, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.Event().wait()  # the client never disconnects
+
+        async def send(message):
+            sent.append(message)
+
+        self.loop.run_until_complete(self.asgi_app(scope, receive, send))
+        start = sent[0]
+        response_headers = {name.decode(): value.decode() for name, value in start['headers']}
+        if response_headers.get('set-cookie', '').startswith('session='):
+            self.cookie = response_headers['set-cookie'].split(';', 1)[0]
+        data = b''.join(message.get('body', b'') for message in sent[1:])
+        if response_headers.get('content-type') != 'application/json':
+            return start['status'], data
+        return start['status'], json.loads(data)
+
+    def log_in(self, email):
+        self.request('POST', '/api/register', {'email': email, 'password': 'secret'})
+        return self.request('POST', '/api/login', {'email': email, 'password': 'secret'})[1]['id']
+
+
+@pytest.fixture(scope='module')
+def asgi(app_module):
+    import asgi
+    return asgi
+
+
+@pytest.fixture(scope='module')
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def make_pair(app_module, asgi, loop):
+    """An ASGI client and a Flask test client logged in as the same new user."""
+    count = [0]
+
+    def make():
+        count[0] += 1
+        email = f'asgi{id(count)}-{count[0]}@example.com'
+        asgi_client = ASGIClient(asgi.asgi_app, loop)
+        user_id = asgi_client.log_in(email)
+        flask_client = app_module.app.test_client()
+        flask_client.post('/api/login', json={'email': email, 'password': 'secret'})
+        return asgi_client, flask_client, user_id
+    return make
+
+
+def test_async_reads_match_the_flask_views(make_pair):
+    asgi_client, flask_client, _ = make_pair()
+    # Created through the ASGI app, i.e. by the sync views behind it
+    _, folder = asgi_client.request('POST', '/api/task-lists', {'title': 'Folder', 'is_folder': True})
+    _, task_list = asgi_client.request('POST', '/api/task-lists', {'title': 'Child', 'parent_id': folder['id']})
+    _, top = asgi_client.request('POST', '/api/task-lists', {'title': 'Top'})
+    for title in ('One', 'Two'):
+        asgi_client.request('POST', f"/api/task-lists/{top['id']}/tasks", {'title': title, 'priority': 'high'})
+    _, archived = asgi_client.request('POST', '/api/task-lists', {'title': 'Old'})
+    asgi_client.request('POST', f"/api/task-lists/{archived['id']}/tasks", {'title': 'Archived'})
+    asgi_client.request('POST', f"/api/task-lists/{archived['id']}/archive")
+
+    for path in ('/api/task-lists', '/api/task-lists?include_archived=1', f"/api/task-lists/{top['id']}/tasks",
+                 f"/api/task-lists/{top['id']}/tasks?window=1&limit=1",
+                 f"/api/task-lists/{archived['id']}/tasks?include_archived=1"):
+        status, data = asgi_client.request('GET', path)
+        flask_response = flask_client.get(path)
+        assert (status, data) == (flask_response.status_code, flask_response.get_json()), path
+
+    assert asgi_client.request('GET', f"/api/task-lists/{task_list['id'] + 1000}/tasks")[0] == 404
+
+
+def test_unauthenticated_requests_get_the_flask_401(asgi, loop):
+    assert ASGIClient(asgi.asgi_app, loop).request('GET', '/api/task-lists')[0] == 401
+
+
+def test_buffered_update_is_read_back(make_pair):
+    asgi_client, _, _ = make_pair()
+    _, task_list = asgi_client.request('POST', '/api/task-lists', {'title': 'List'})
+    _, task = asgi_client.request('POST', f"/api/task-lists/{task_list['id']}/tasks", {'title': 'Task'})
+
+    status, data = asgi_client.request('PUT', f"/api/tasks/{task['id']}", {'completed': True})
+    assert (status, data['pending']) == (202, True)
+    _, tasks = asgi_client.request('GET', f"/api/task-lists/{task_list['id']}/tasks")
+    assert [item['completed'] for item in tasks] == [True]
+
+
+def test_direct_update(app_module, asgi, make_pair, monkeypatch):
+    monkeypatch.setattr(asgi, 'write_behind', None)
+    asgi_client, _, user_id = make_pair()
+    _, task_list = asgi_client.request('POST', '/api/task-lists', {'title': 'List'})
+    _, task = asgi_client.request('POST', f"/api/task-lists/{task_list['id']}/tasks", {'title': 'Task'})
+
+    status, data = asgi_client.request('PUT', f"/api/tasks/{task['id']}", {'title': 'Renamed', 'priority': 'low'})
+    assert status == 200
+    assert (data['title'], data['priority'], data['task_list_id']) == ('Renamed', 'low', task_list['id'])
+    with app_module.app.app_context():
+        db.session.info['shard'] = app_module.db_router.shard_for_user(user_id)
+        stored = db.session.get(Task, task['id'])
+        assert (stored.title, stored.priority_rank) == ('Renamed', 2)
+
+    assert asgi_client.request('PUT', f"/api/tasks/{task['id']}", {'completed': 'yes'})[0] == 400
+    assert asgi_client.request('PUT', '/api/tasks/999999', {'completed': True})[0] == 404
+
+
+def test_other_updates_fall_through_to_the_flask_view(make_pair):
+    asgi_client, _, _ = make_pair()
+    _, task_list = asgi_client.request('POST', '/api/task-lists', {'title': 'List'})
+    _, parent = asgi_client.request('POST', f"/api/task-lists/{task_list['id']}/tasks", {'title': 'Parent'})
+    _, task = asgi_client.request('POST', f"/api/task-lists/{task_list['id']}/tasks", {'title': 'Task'})
+
+    status, data = asgi_client.request('PUT', f"/api/tasks/{task['id']}", {'parent_id': parent['id']})
+    assert (status, data['parent_id'], data['level']) == (200, parent['id'], 1)
+
+
+def test_firebase_login(asgi, loop):
+    client = ASGIClient(asgi.asgi_app, loop)
+    with mock.patch('firebase_admin.auth.verify_id_token', return_value={'email': 'fb@example.com'}):
+        status, user = client.request('POST', '/api/login/firebase',
+                                      {'idToken': 'token', 'email': 'fb@example.com', 'name': 'Fb'})
+        assert status == 200
+        assert client.request('GET', '/api/user') == (200, user)
+        assert client.request('POST', '/api/login/firebase', {'idToken': 'token', 'email': 'other@example.com'})[0] == 401
+    assert client.request('POST', '/api/login/firebase', {'email': 'fb@example.com'})[0] == 400
@@ -0,0 +1,20 @@
+def create_list(client, *titles):
+    task_list = client.post('/api/task-lists', json={'title': 'List'}).get_json()
+    task_ids = [client.post(f"/api/task-lists/{task_list['id']}/tasks", json={'title': title}).get_json()['id']
+                for title in titles]
+    return task_list['id'], task_ids
+
+
+def test_copies_never_reuse_archived_or_deleted_ids(make_client):
+    client, _ = make_client()
+    _, (task_id,) = create_list(client, 'Keep')
+    archived_list_id, archived_ids = create_list(client, 'Archived', 'Archived too')
+    client.post(f'/api/task-lists/{archived_list_id}/archive')
+
+    copy_id = client.post(f'/api/tasks/{task_id}/duplicate').get_json()['id']
+    assert copy_id > max(archived_ids)
+
+    # The highest id handed out so far now belongs to a deleted task
+    client.delete(f'/api/tasks/{copy_id}')
+    assert client.post(f'/api/tasks/{task_id}/duplicate').get_json()['id'] > copy_id
+
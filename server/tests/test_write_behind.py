@@ -0,0 +1,203 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models import db, Task
+from writebehind import WriteBehindBuffer
+
+
+def create_task(client, title='Task'):
+    task_list = client.post('/api/task-lists', json={'title': 'List'}).get_json()
+    task = client.post(f"/api/task-lists/{task_list['id']}/tasks", json={'title': title}).get_json()
+    return task_list['id'], task['id']
+
+
+def stored_task(app_module, user_id, task_id):
+    with app_module.app.app_context():
+        db.session.info['shard'] = app_module.db_router.shard_for_user(user_id)
+        task = db.session.get(Task, task_id)
+        return {'title': task.title, 'completed': task.completed, 'priority': task.priority,
+                'priority_rank': task.priority_rank}
+
+
+def test_updates_are_merged_and_acknowledged(app_module, make_client):
+    client, user_id = make_client()
+    list_id, task_id = create_task(client)
+
+    assert client.put(f'/api/tasks/{task_id}', json={'completed': True}).status_code == 202
+    response = client.put(f'/api/tasks/{task_id}', json={'title': 'Renamed', 'priority': 'high'})
+
+    assert response.status_code == 202
+    assert response.get_json() == {'id': task_id, 'task_list_id': list_id, 'pending': True,
+                                   'completed': True, 'title': 'Renamed', 'priority': 'high'}
+    assert stored_task(app_module, user_id, task_id)['title'] == 'Task'
+
+    assert app_module.write_behind.flush() == 1
+    assert stored_task(app_module, user_id, task_id) == {'title': 'Renamed', 'completed': True,
+                                                         'priority': 'high', 'priority_rank': 0}
+
+
+def test_next_request_of_the_same_user_flushes(app_module, make_client):
+    client, user_id = make_client()
+    other_client, _ = make_client()
+    list_id, task_id = create_task(client)
+    client.put(f'/api/tasks/{task_id}', json={'completed': True})
+
+    other_client.get('/api/task-lists')
+    assert app_module.write_behind.has_pending(user_id)
+
+    tasks = client.get(f'/api/task-lists/{list_id}/tasks').get_json()
+    assert not app_module.write_behind.has_pending(user_id)
+    assert [task['completed'] for task in tasks if task['id'] == task_id] == [True]
+
+
+def test_interval_flush():
+    applied = []
+    buffer = WriteBehindBuffer(lambda shard, entries: applied.extend(entries), interval=0.05, max_pending=100)
+    buffer.add(1, 7, 0, 3, {'completed': True})
+
+    deadline = time.time() + 2
+    while not applied and time.time() < deadline:
+        time.sleep(0.01)
+    assert [(entry['task_id'], entry['fields']) for entry in applied] == [(1, {'completed': True})]
+    assert not buffer.pending
+
+
+def test_later_database_write_wins(app_module, make_client):
+    client, user_id = make_client()
+    _, task_id = create_task(client)
+    client.put(f'/api/tasks/{task_id}', json={'title': 'Buffered'})
+
+    # A direct write committed after the acknowledgement, e.g. by another worker process
+    with app_module.app.app_context():
+        db.session.info['shard'] = app_module.db_router.shard_for_user(user_id)
+        db.session.execute(db.update(Task).where(Task.id == task_id).values(
+            title='Direct', updated_at=datetime.utcnow() + timedelta(seconds=1)))
+        db.session.commit()
+
+    app_module.write_behind.flush()
+    assert stored_task(app_module, user_id, task_id)['title'] == 'Direct'
+
+
+def test_failed_flush_is_requeued():
+    applied, failing = [], [True]
+
+    def apply(shard, entries):
+        if failing[0]:
+            raise RuntimeError('database is locked')
+        applied.extend(entries)
+
+    buffer = WriteBehindBuffer(apply, interval=3600, max_pending=100)
+    buffer.add(1, 7, 0, 3, {'title': 'First', 'completed': True})
+    buffer.flush()
+    assert buffer.get(0, 1, 7)['fields'] == {'title': 'First', 'completed': True}
+
+    failing[0] = False
+    buffer.add(1, 7, 0, 3, {'title': 'Second'})
+    buffer.flush()
+    assert [entry['fields'] for entry in applied] == [{'title': 'Second', 'completed': True}]
+    assert not buffer.pending
+
+
+def test_failing_entry_does_not_hold_back_others():
+    applied = []
+
+    def apply(shard, entries):
+        if any(entry['task_id'] == 2 for entry in entries):
+            raise RuntimeError('constraint failed')
+        applied.extend(entries)
+
+    buffer = WriteBehindBuffer(apply, interval=3600, max_pending=100, max_attempts=3)
+    buffer.add(1, 7, 0, 3, {'completed': True})
+    buffer.add(2, 7, 0, 3, {'completed': True})
+    buffer.add(3, 7, 0, 3, {'completed': True})
+    buffer.flush()
+    assert sorted(entry['task_id'] for entry in applied) == [1, 3]
+    assert list(buffer.pending) == [(0, 2)]
+
+    buffer.flush()
+    buffer.flush()
+    assert not buffer.pending
+    assert [entry['task_id'] for entry in buffer.dead_letters] == [2]
+
+
+def test_same_task_id_on_two_shards(app_module, make_client):
+    clients = {}
+    while len(clients) < 2:
+        client, user_id = make_client()
+        clients.setdefault(app_module.db_router.shard_for_user(user_id), (client, user_id))
+    (client_a, user_a), (client_b, user_b) = clients.values()
+    list_a, _ = create_task(client_a)
+    list_b, _ = create_task(client_b)
+
+    # Ids are only unique per shard, so both users can own a task with the same id
+    task_id = 100000
+    for user_id, list_id in ((user_a, list_a), (user_b, list_b)):
+        with app_module.app.app_context():
+            db.session.info['shard'] = app_module.db_router.shard_for_user(user_id)
+            db.session.add(Task(id=task_id, title='Shared id', task_list_id=list_id))
+            db.session.commit()
+
+    client_a.put(f'/api/tasks/{task_id}', json={'title': 'A'})
+    response = client_b.put(f'/api/tasks/{task_id}', json={'completed': True})
+    assert response.status_code == 202
+    assert response.get_json() == {'id': task_id, 'task_list_id': list_b, 'pending': True, 'completed': True}
+
+    app_module.write_behind.flush()
+    assert stored_task(app_module, user_a, task_id)['title'] == 'A'
+    assert stored_task(app_module, user_a, task_id)['completed'] is False
+    assert stored_task(app_module, user_b, task_id)['title'] == 'Shared id'
+    assert stored_task(app_module, user_b, task_id)['completed'] is True
+
+
+def test_invalid_values_are_rejected(app_module, make_client):
+    client, user_id = make_client()
+    _, task_id = create_task(client)
+
+    for data in ({'title': None}, {'title': 'x' * 256}, {'completed': 'yes'}, {'priority': 1},
+                 {'due_date': 'tomorrow'}, {'due_date': 20250101}):
+        assert client.put(f'/api/tasks/{task_id}', json=data).status_code == 400
+    assert not app_module.write_behind.has_pending(user_id)
+
+
+def test_request_waits_for_a_flush_in_progress():
+    applied, started = [], threading.Event()
+
+    def apply(shard, entries):
+        started.set()
+        time.sleep(0.3)
+        applied.extend(entries)
+
+    buffer = WriteBehindBuffer(apply, interval=3600, max_pending=100)
+    buffer.add(1, 7, 0, 3, {'completed': True})
+    flusher = threading.Thread(target=buffer.flush)
+    flusher.start()
+    started.wait(2)
+
+    # What flush_pending_task_updates does for user 7's next request
+    assert buffer.has_pending(7)
+    buffer.flush(7)
+    assert [entry['task_id'] for entry in applied] == [1]
+    assert not buffer.has_pending(7)
+    flusher.join()
+
+
+def test_failed_flush_stays_pending_until_requeued():
+    started, release = threading.Event(), threading.Event()
+
+    def apply(shard, entries):
+        started.set()
+        release.wait(2)
+        raise RuntimeError('database is locked')
+
+    buffer = WriteBehindBuffer(apply, interval=3600, max_pending=100)
+    buffer.add(1, 7, 0, 3, {'completed': True})
+    flusher = threading.Thread(target=buffer.flush)
+    flusher.start()
+    started.wait(2)
+
+    assert buffer.has_pending(7)
+    release.set()
+    flusher.join()
+    assert buffer.has_pending(7)
+    assert buffer.get(0, 1, 7)['fields'] == {'completed': True}
@@ -0,0 +1,152 @@
+import json
+import zlib
+from datetime import datetime, timezone
+from flask import Response, jsonify, request, stream_with_context
+
+# Optional encoders; formats that need a missing package are simply not offered
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+COLUMNAR_MIMETYPE = 'application/vnd.simpletask.columnar+json'
+COMPRESSIBLE_MIMETYPES = {'application/json', MSGPACK_MIMETYPE, COLUMNAR_MIMETYPE}
+
+# Sent as epoch seconds instead of ISO strings in the compact formats
+TIMESTAMP_FIELDS = ('created_at', 'updated_at', 'due_date')
+
+
+def negotiate_format():
+    """Pick the response format from ?format= or the Accept header."""
+    requested = request.args.get('format')
+    if requested == 'msgpack' and msgpack is not None:
+        return MSGPACK_MIMETYPE
+    if requested == 'columnar':
+        return COLUMNAR_MIMETYPE
+    offered = ['application/json', COLUMNAR_MIMETYPE]
+    if msgpack is not None:
+        offered.append(MSGPACK_MIMETYPE)
+    return request.accept_mimetypes.best_match(offered, default='application/json')
+
+
+def epoch_seconds(value):
+    if not value:
+        return None
+    return int(datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp())
+
+
+def to_columnar(rows):
+    """Turn a list of dicts into a key list plus row arrays, with compact timestamps."""
+    columns = list(rows[0].keys()) if rows else []
+    timestamp_indexes = [i for i, column in enumerate(columns) if column in TIMESTAMP_FIELDS]
+    encoded = []
+    for row in rows:
+        values = [row.get(column) for column in columns]
+        for i in timestamp_indexes:
+            values[i] = epoch_seconds(values[i])
+        encoded.append(values)
+    return {"columns": columns, "rows": encoded}
+
+
+def stream_columnar(columnar, chunk_rows=500):
+    """Yield a columnar payload as JSON in chunks of rows."""
+    yield '{"columns":' + json.dumps(columnar["columns"]) + ',"rows":['
+    rows = columnar["rows"]
+    for start in range(0, len(rows), chunk_rows):
+        chunk = ','.join(json.dumps(row, separators=(',', ':')) for row in rows[start:start + chunk_rows])
+        yield (',' if start else '') + chunk
+    yield ']}'
+
+
+def payload_response(payload, config):
+    """Encode a JSON-style payload in the format the client asked for."""
+    mimetype = negotiate_format()
+
+    # A page of objects, e.g. {"items": [...], "next_cursor": 42}
+    if isinstance(payload, dict) and isinstance(payload.get('items'), list) and mimetype != 'application/json':
+        page = dict(payload, items=to_columnar(payload['items']))
+        if mimetype == MSGPACK_MIMETYPE:
+            response = Response(msgpack.packb(page), mimetype=MSGPACK_MIMETYPE)
+        else:
+            response = Response(json.dumps(page, separators=(',', ':')), mimetype=COLUMNAR_MIMETYPE)
+        response.headers['X-Timestamp-Format'] = 'epoch-seconds'
+        response.vary.add('Accept')
+        return response
+
+    # The compact formats only apply to lists of objects, e.g. the tasks of a list
+    if mimetype == 'application/json' or not isinstance(payload, list):
+        response = jsonify(payload)
+    elif mimetype == MSGPACK_MIMETYPE:
+        response = Response(msgpack.packb(to_columnar(payload)), mimetype=MSGPACK_MIMETYPE)
+    elif len(payload) >= config['STREAM_MIN_ROWS']:
+        response = Response(stream_with_context(stream_columnar(to_columnar(payload))), mimetype=COLUMNAR_MIMETYPE)
+    else:
+        response = Response(json.dumps(to_columnar(payload), separators=(',', ':')), mimetype=COLUMNAR_MIMETYPE)
+
+    if mimetype != 'application/json' and isinstance(payload, list):
+        response.headers['X-Timestamp-Format'] = 'epoch-seconds'
+    response.vary.add('Accept')
+    return response
+
+
+def choose_encoding():
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compressor(encoding, level):
+    """Return (compress, finish) callables for incremental compression."""
+    if encoding == 'br':
+        # Brotli quality 0-11; map the gzip-style 1-9 level onto it
+        stream = brotli.Compressor(quality=min(11, level + 1))
+        return stream.process, stream.finish
+    stream = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    return stream.compress, stream.flush
+
+
+def compress_response(response, config):
+    """after_request hook: gzip/brotli compress large responses, streamed or not."""
+    if (response.status_code < 200 or response.status_code >= 300
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    compress, finish = compressor(encoding, config['COMPRESS_LEVEL'])
+
+    if response.is_streamed:
+        chunks = response.response
+
+        def generate():
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                data = compress(chunk)
+                if data:
+                    yield data
+            yield finish()
+
+        response.response = generate()
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress(body) + finish())
+
+    response.headers['Content-Encoding'] = encoding
+    return response
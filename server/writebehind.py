@@ -0,0 +1,155 @@
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+
+# Fields whose updates only overwrite a value, so several of them can be merged into one
+COALESCED_FIELDS = {'completed', 'title', 'priority', 'due_date'}
+
+
+class WriteBehindBuffer:
+    """Per-process buffer of acknowledged task updates that aren't in the database yet.
+
+    Semantics:
+    - Durability: an acknowledged update is held in this process's memory until the
+      next flush, at most `interval` seconds later (sooner when `max_pending` tasks
+      are waiting). Flushes also run at a clean exit; a crash or kill -9 loses the
+      updates of the last interval. When a flush fails, its entries are retried one
+      by one, so a single bad entry can't hold back the others; entries that still
+      fail are retried on the following flushes and dropped into `dead_letters`
+      after `max_attempts` failures.
+    - Read-your-writes: before any other request from the same user is handled by
+      this process, that user's pending updates are flushed and committed, so reads
+      (and non-coalesced writes) see them. Updates that a flush on another thread
+      has taken but not yet committed count as pending, so the request waits for
+      that flush instead of reading around it. Other worker processes see them only
+      after the flush, i.e. within `interval` seconds.
+    - Ordering: updates to one task are merged in arrival order, the last value of
+      each field wins. A merged update is not applied if the task was changed in
+      the database after it was acknowledged, e.g. by a direct write in another
+      process, so the later acknowledged write wins there too.
+    """
+
+    def __init__(self, apply, interval, max_pending, max_attempts=5):
+        self.apply = apply  # apply(shard, entries) writes and commits one shard's entries
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        # Task ids are only unique within a shard, so entries are keyed by both
+        self.pending = {}  # (shard, task id) -> entry
+        # Entries taken by a flush that hasn't committed (or requeued) them yet still count as pending
+        self.in_flight = {}  # user id -> number of entries
+        self.dead_letters = []
+        self.lock = threading.Lock()
+        # Held for a whole flush, so a read-path flush waits for one already writing
+        self.flush_lock = threading.Lock()
+        self.thread_pid = None
+        atexit.register(self.flush)
+
+    @classmethod
+    def from_config(cls, config, apply):
+        if not config['WRITE_BEHIND']:
+            return None
+        return cls(apply, config['WRITE_BEHIND_INTERVAL'], config['WRITE_BEHIND_MAX_PENDING'])
+
+    def add(self, task_id, user_id, shard, task_list_id, fields):
+        """Merge `fields` into the task's pending update; return the merged fields."""
+        self.start()
+        with self.lock:
+            entry = self.pending.setdefault((shard, task_id), {
+                'task_id': task_id,
+                'user_id': user_id,
+                'shard': shard,
+                'task_list_id': task_list_id,
+                'fields': {},
+                'attempts': 0
+            })
+            entry['fields'].update(fields)
+            entry['acked_at'] = datetime.utcnow()
+            merged = dict(entry['fields'])
+            full = len(self.pending) >= self.max_pending
+        if full:
+            self.flush()
+        return merged
+
+    def get(self, shard, task_id, user_id):
+        with self.lock:
+            entry = self.pending.get((shard, task_id))
+            if entry is None or entry['user_id'] != user_id:
+                return None
+            return dict(entry, fields=dict(entry['fields']))
+
+    def has_pending(self, user_id):
+        with self.lock:
+            return (self.in_flight.get(user_id, 0) > 0
+                    or any(entry['user_id'] == user_id for entry in self.pending.values()))
+
+    def flush(self, user_id=None):
+        """Write pending updates (only `user_id`'s if given) in one transaction per shard."""
+        with self.flush_lock:
+            with self.lock:
+                taken = [entry for entry in self.pending.values() if user_id is None or entry['user_id'] == user_id]
+                for entry in taken:
+                    del self.pending[(entry['shard'], entry['task_id'])]
+                    self.in_flight[entry['user_id']] = self.in_flight.get(entry['user_id'], 0) + 1
+            if not taken:
+                return 0
+
+            by_shard = {}
+            for entry in taken:
+                by_shard.setdefault(entry['shard'], []).append(entry)
+
+            try:
+                for shard, entries in by_shard.items():
+                    try:
+                        self.apply(shard, entries)
+                    except Exception as e:
+                        print(f"Write-behind flush of {len(entries)} tasks failed, retrying them one by one: {e}")
+                        for entry in entries:
+                            self.apply_one(shard, entry)
+            finally:
+                # Failed entries were requeued above, so they count as pending throughout
+                with self.lock:
+                    for entry in taken:
+                        self.in_flight[entry['user_id']] -= 1
+                        if not self.in_flight[entry['user_id']]:
+                            del self.in_flight[entry['user_id']]
+            return len(taken)
+
+    def apply_one(self, shard, entry):
+        try:
+            self.apply(shard, [entry])
+        except Exception as e:
+            entry['attempts'] += 1
+            if entry['attempts'] >= self.max_attempts:
+                print(f"Dropping write-behind update of task {entry['task_id']} on shard {shard}: {e}")
+                self.dead_letters.append(entry)
+            else:
+                self.requeue([entry])
+
+    def requeue(self, entries):
+        with self.lock:
+            for entry in entries:
+                key = (entry['shard'], entry['task_id'])
+                newer = self.pending.get(key)
+                if newer is not None:
+                    # Updates that arrived meanwhile win over the failed ones
+                    entry['fields'].update(newer['fields'])
+                    entry['acked_at'] = newer['acked_at']
+                self.pending[key] = entry
+
+    def start(self):
+        """Start the interval flusher in this process (again after a fork)."""
+        if self.thread_pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread_pid == os.getpid():
+                return
+            self.thread_pid = os.getpid()
+        threading.Thread(target=self.run, name='write-behind', daemon=True).start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()